@@ -0,0 +1,60 @@
+import base64
+import json
+import os
+import timeit
+
+import Codec
+from Bot import extract_text
+
+def make_request():
+    return {
+        "contents": [{
+            "parts": [
+                {"inline_data": {"mime_type": "image/jpeg", "data": base64.b64encode(os.urandom(150_000)).decode()}},
+                {"text": "Что изображено на этой картинке? Ответь подробно, с примерами. " * 20}
+            ]
+        }],
+        "systemInstruction": {"parts": [{"text": "You are Tucnify, a helpful assistant. " * 200}]}
+    }
+
+def make_response(candidates=3, parts=4):
+    safety = [
+        {"category": f"HARM_CATEGORY_{name}", "probability": "NEGLIGIBLE"}
+        for name in ("HARASSMENT", "HATE_SPEECH", "SEXUALLY_EXPLICIT", "DANGEROUS_CONTENT")
+    ]
+    return {
+        "candidates": [{
+            "content": {
+                "parts": [{"text": "## Ответ\n\n" + "Lorem ipsum dolor sit amet, `code` и **markdown**. " * 60}] * parts,
+                "role": "model"
+            },
+            "finishReason": "STOP",
+            "index": index,
+            "safetyRatings": safety,
+            "citationMetadata": {"citationSources": [{"startIndex": 1, "endIndex": 200, "uri": "https://example.com"}] * 5}
+        } for index in range(candidates)],
+        "usageMetadata": {"promptTokenCount": 1530, "candidatesTokenCount": 2210, "totalTokenCount": 3740},
+        "modelVersion": "gemini-1.5-flash-002"
+    }
+
+def stdlib_dumps(data):
+    return json.dumps(data).encode()
+
+def bench(label, function, number):
+    seconds = min(timeit.repeat(function, number=number, repeat=5)) / number
+    print(f"{label:<44}{seconds * 1_000_000:>10.1f} us")
+
+def main():
+    request = make_request()
+    response = make_response()
+    response_body = stdlib_dumps(response)
+    print(f"Codec: {Codec.NAME}, request {len(stdlib_dumps(request)) // 1024} KiB, response {len(response_body) // 1024} KiB\n")
+
+    bench("encode request, json.dumps", lambda: stdlib_dumps(request), 200)
+    bench(f"encode request, Codec.dumps ({Codec.NAME})", lambda: Codec.dumps(request), 200)
+    bench("decode response, json.loads", lambda: json.loads(response_body), 500)
+    bench(f"decode response, Codec.loads ({Codec.NAME})", lambda: Codec.loads(response_body), 500)
+    bench("decode + extract_text", lambda: extract_text(Codec.loads(response_body)), 500)
+
+if __name__ == '__main__':
+    main()
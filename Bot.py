@@ -1,75 +1,700 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import threading
+import time
+import weakref
+from collections import Counter
+
 import aiohttp
 from aiogram import Bot, Dispatcher, types
+from aiogram.exceptions import TelegramAPIError, TelegramNotFound, TelegramUnauthorizedError
 from aiogram.filters import Command
 from aiogram.enums import ParseMode
 
+import Codec
+import Diagnostics
+import Jobs
+import Media
+import Sender
+import SemanticCache
+import Store
+import Transcripts
+import Usage
+
 DEFAULT_API_TOKEN = ' '  # Telegram Bot API Token
 DEFAULT_GEMINI_KEY = ' '  # Gemini API Key
 
 API_TOKEN = DEFAULT_API_TOKEN
 GEMINI_API_KEY = DEFAULT_GEMINI_KEY
+SYSTEM_INSTRUCTION = ''  # Optional persona / instructions sent with every prompt
+
+GEMINI_API_BASE = 'https://generativelanguage.googleapis.com/v1beta'
+GEMINI_MODEL = 'gemini-1.5-flash'
+CACHE_MODEL = 'gemini-1.5-flash-002'  # Context caching needs a pinned model version
+GEMINI_HEADERS = {
+    'Content-Type': 'application/json',
+    'Accept-Encoding': 'gzip',
+    'User-Agent': 'Tucnify (gzip)'  # Google APIs only compress responses for user agents mentioning gzip
+}
+
+CACHE_MIN_CHARS = 131072  # gemini-1.5-flash-002 caches at least 32768 tokens (~4 chars each), shorter instructions are sent inline
+CACHE_TTL = 3600
+CACHE_REFRESH_MARGIN = 300
+
+DRAIN_TIMEOUT = 10  # Seconds in-flight replies get to finish when a bot stops, unfinished ones are dropped
+QUEUE_WORKERS = 0  # Worker processes answering through the persistent job queue, 0 answers in-process
+QUEUE_ANSWER_INTERVAL = 2  # Seconds between collecting queue answers for the semantic cache
+QUEUE_ANSWER_LIMIT = 500  # Queued prompts waiting for their answer to be cached, the oldest are forgotten
+SEMANTIC_CACHE = False  # Reuse answers for prompts similar to earlier ones, needs numpy
+TRANSCRIPTS = False  # Log prompts and replies to compressed files in Transcripts.TRANSCRIPT_DIR
+INLINE_DEBOUNCE = 0.8  # Seconds an inline query must stay unchanged before it is answered
+INLINE_CACHE_TTL = 300  # Seconds inline answers are reused, by the bot and by Telegram
+INLINE_CACHE_SIZE = 1000
+VALIDATE_CONCURRENCY = 8  # Bots whose tokens are checked at the same time on startup
+VALIDATE_TIMEOUT = 10
+KEEPALIVE_TIMEOUT = 120  # Seconds an idle Gemini connection is kept open for the next request
 
 MESSAGES = {
     'welcome': """👋 *Hi! Tucnify is a free AI bot, you can ask it directly in the chat*""",
     'no_api_key': "⚠️ Error: Gemini API key not set",
     'api_error': "⚠️ Error accessing the API",
-    'process_error': "❌ Couldn't process the response"
+    'process_error': "❌ Couldn't process the response",
+    'media_error': "⚠️ Couldn't process this file",
+    'budget_exceeded': "⏳ You have used up today's limit, please come back tomorrow"
 }
 
-def get_gemini_url():
-    return f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={GEMINI_API_KEY}'
+def get_gemini_url(api_key=None, model=GEMINI_MODEL):
+    return f'{GEMINI_API_BASE}/models/{model}:generateContent?key={api_key or GEMINI_API_KEY}'
+
+gemini_sessions = weakref.WeakKeyDictionary()
+
+def get_gemini_session():
+    # One pooled session per event loop, so requests reuse warm DNS, TCP and TLS state
+    loop = asyncio.get_running_loop()
+    session = gemini_sessions.get(loop)
+    if session is None or session.closed:
+        connector = aiohttp.TCPConnector(keepalive_timeout=KEEPALIVE_TIMEOUT, ttl_dns_cache=600)
+        session = gemini_sessions[loop] = aiohttp.ClientSession(
+            connector=connector, headers=GEMINI_HEADERS, json_serialize=Codec.dumps_text
+        )
+    return session
+
+async def close_gemini_session():
+    session = gemini_sessions.pop(asyncio.get_running_loop(), None)
+    if session:
+        await session.close()
+
+async def check_gemini_key(api_key):
+    # Returns (error, fatal), only a rejected key keeps a bot from starting
+    try:
+        url = f'{GEMINI_API_BASE}/models/{GEMINI_MODEL}?key={api_key}'
+        async with get_gemini_session().get(url, timeout=aiohttp.ClientTimeout(total=VALIDATE_TIMEOUT)) as response:
+            await response.read()
+            if response.status in (400, 401, 403):
+                return "Gemini API key is invalid", True
+            if response.status != 200:
+                return f"Gemini API returned {response.status}", False
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return f"Gemini API is unreachable: {str(e) or type(e).__name__}", False
+    return None, False
+
+async def check_telegram_token(bot):
+    # Returns (username, error, fatal)
+    try:
+        return (await bot.get_me(request_timeout=VALIDATE_TIMEOUT)).username, None, False
+    except (TelegramUnauthorizedError, TelegramNotFound) as e:
+        return None, f"Telegram token is invalid: {e.message}", True
+    except TelegramAPIError as e:
+        return None, f"Telegram API returned an error: {e.message}", False
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        return None, f"Telegram API is unreachable: {str(e) or type(e).__name__}", False
+
+def pick_error(*checks):
+    # (error, fatal) pairs, a fatal error is reported before a transient one
+    errors = [check for check in checks if check[0]]
+    errors.sort(key=lambda check: not check[1])
+    return errors[0] if errors else (None, False)
+
+async def check_bots(bots, concurrency=VALIDATE_CONCURRENCY):
+    # bots is a list of (telegram_token, gemini_key), results are (username, error, fatal) in the same order
+    limit = asyncio.Semaphore(concurrency)
+
+    async def check(telegram_token, gemini_key):
+        async with limit:
+            bot = Bot(token=telegram_token)
+            try:
+                (username, *telegram_check), gemini_check = await asyncio.gather(
+                    check_telegram_token(bot), check_gemini_key(gemini_key)
+                )
+            finally:
+                await bot.session.close()
+            return (username, *pick_error(telegram_check, gemini_check))
+
+    return await asyncio.gather(*(check(*bot) for bot in bots))
+
+context_caches = {}
+uncacheable_instructions = set()
+cache_locks = weakref.WeakKeyDictionary()  # loop -> {cache key: lock}
+cache_users = Counter()  # cache key -> running bots with that key and instruction
+cache_users_lock = threading.Lock()
+
+def get_cache_key(api_key, instruction):
+    return api_key, hashlib.sha256(instruction.encode()).hexdigest()
+
+def get_cache_lock(key):
+    locks = cache_locks.setdefault(asyncio.get_running_loop(), {})
+    if key not in locks:
+        locks[key] = asyncio.Lock()
+    return locks[key]
+
+async def get_cached_content(session, api_key, instruction):
+    if len(instruction) < CACHE_MIN_CHARS:
+        return None
+
+    key = get_cache_key(api_key, instruction)
+    if key in uncacheable_instructions:
+        return None
+
+    entry = context_caches.get(key)
+    if entry and entry['expires'] - time.monotonic() > CACHE_REFRESH_MARGIN:
+        return entry['name']
 
-bot = None
-dp = Dispatcher()
+    # A burst of first messages waits for one create call instead of each paying for its own cache
+    async with get_cache_lock(key):
+        return await refresh_cached_content(session, api_key, instruction, key)
 
-async def generate_gemini_response(prompt: str) -> str:
-    if not GEMINI_API_KEY:
-        return MESSAGES['no_api_key']
+async def refresh_cached_content(session, api_key, instruction, key):
+    if key in uncacheable_instructions:
+        return None
+
+    now = time.monotonic()
+    entry = context_caches.get(key)
+    if entry and entry['expires'] - now > CACHE_REFRESH_MARGIN:
+        return entry['name']
+
+    if entry and entry['expires'] > now:
+        url = f"{GEMINI_API_BASE}/{entry['name']}?key={api_key}"
+        async with session.patch(url, json={'ttl': f'{CACHE_TTL}s'}) as response:
+            if response.status == 200:
+                entry['expires'] = now + CACHE_TTL
+                return entry['name']
+    context_caches.pop(key, None)
+
+    payload = {
+        'model': f'models/{CACHE_MODEL}',
+        'systemInstruction': {'parts': [{'text': instruction}]},
+        'ttl': f'{CACHE_TTL}s'
+    }
+    async with session.post(f'{GEMINI_API_BASE}/cachedContents?key={api_key}', json=payload) as response:
+        if response.status != 200:
+            if response.status == 400:
+                # Too short for the model or caching unavailable for this key, rate limits and outages are retried
+                uncacheable_instructions.add(key)
+            return None
+        json_response = Codec.loads(await response.read())
+
+    context_caches[key] = {'name': json_response['name'], 'expires': now + CACHE_TTL}
+    return json_response['name']
+
+def use_context_cache(api_key, instruction):
+    if instruction:
+        with cache_users_lock:
+            cache_users[get_cache_key(api_key, instruction)] += 1
+
+async def release_context_cache(api_key, instruction):
+    # Deleted upstream once no running bot uses it, bots sharing the key and instruction keep theirs
+    if not instruction:
+        return
+    key = get_cache_key(api_key, instruction)
+    with cache_users_lock:
+        cache_users[key] -= 1
+        if cache_users[key] > 0:
+            return
+        del cache_users[key]
+        entry = context_caches.pop(key, None)
+    if entry is None:
+        return
+
+    try:
+        async with get_gemini_session().delete(f"{GEMINI_API_BASE}/{entry['name']}?key={api_key}"):
+            pass
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+
+async def post_gemini(session, url, payload):
+    async with session.post(url, data=Codec.dumps(payload)) as response:
+        return response.status, await response.read()
+
+async def generate_gemini_response(prompt: str, api_key: str = None, system_instruction: str = None, media: list = None, messages: dict = None, account: tuple = None) -> str:
+    api_key = api_key or GEMINI_API_KEY
+    messages = messages or MESSAGES
+    if system_instruction is None:
+        system_instruction = SYSTEM_INSTRUCTION
+
+    if not api_key:
+        return messages['no_api_key']
         
-    headers = {'Content-Type': 'application/json'}
+    parts = []
     payload = {
         "contents": [{
-            "parts": [{"text": prompt}]
+            "parts": parts
         }]
     }
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(get_gemini_url(), json=payload, headers=headers) as response:
-            if response.status != 200:
-                return MESSAGES['api_error']
+    session = get_gemini_session()
+    try:
+        for item in media or ():
+            parts.append(await Media.build_part(session, GEMINI_API_BASE, api_key, item))
+    except (Media.MediaError, aiohttp.ClientError, asyncio.TimeoutError):
+        return messages['media_error']
+    if prompt:
+        parts.append({"text": prompt})
 
-            json_response = await response.json()
-            try:
-                return json_response['candidates'][0]['content']['parts'][0]['text']
-            except (KeyError, IndexError):
-                return MESSAGES['process_error']
-
-@dp.message(Command("start"))
-async def cmd_start(message: types.Message):
-    await message.answer(MESSAGES['welcome'], parse_mode=ParseMode.MARKDOWN)
-
-@dp.message()
-async def handle_message(message: types.Message):
-    user_input = message.text
-    await bot.send_chat_action(message.chat.id, 'typing')
-    response = await generate_gemini_response(user_input)
+    model = GEMINI_MODEL
+    if system_instruction:
+        try:
+            cached_content = await get_cached_content(session, api_key, system_instruction)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            cached_content = None  # The cache is only an optimisation, the instruction goes inline
+        if cached_content:
+            payload['cachedContent'] = cached_content
+            model = CACHE_MODEL
+        else:
+            payload['systemInstruction'] = {'parts': [{'text': system_instruction}]}
+
+    started = time.monotonic()
+    try:
+        status, body = await post_gemini(session, get_gemini_url(api_key, model), payload)
+        if status in (403, 404) and 'cachedContent' in payload:
+            # Cache expired or was deleted upstream, retry with the instruction inline
+            context_caches.pop(get_cache_key(api_key, system_instruction), None)
+            del payload['cachedContent']
+            payload['systemInstruction'] = {'parts': [{'text': system_instruction}]}
+            model = GEMINI_MODEL
+            status, body = await post_gemini(session, get_gemini_url(api_key, model), payload)
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        # Connection reset, DNS failure or timeout, the user gets an answer instead of silence
+        return messages['api_error']
+
+    if status != 200:
+        return messages['api_error']
+
+    try:
+        json_response = Codec.loads(body)
+    except ValueError:
+        return messages['process_error']
+    if account:
+        Usage.record(*account, model, api_key, json_response.get('usageMetadata', {}), time.monotonic() - started)
+    return extract_text(json_response) or messages['process_error']
+
+def extract_text(json_response):
+    # Only the first candidate is shown, but its answer can be split over several parts
+    candidates = json_response.get('candidates')
+    if not candidates:
+        return None
+    parts = candidates[0].get('content', {}).get('parts', ())
+    return ''.join(part.get('text', '') for part in parts if not part.get('thought'))
+
+async def generate_media_response(bot, message, api_key=None, system_instruction=None, messages=None, account=None):
+    messages = messages or MESSAGES
+    try:
+        media = await Media.download_media(bot, message)
+    except (Media.MediaError, TelegramAPIError, aiohttp.ClientError):
+        return messages['media_error']
+
+    try:
+        return await generate_gemini_response(message.caption or '', api_key, system_instruction, [media], messages, account)
+    finally:
+        media.close()
+
+def get_cache_namespace(system_instruction):
+    # Answers given under another model or persona must not be reused
+    return hashlib.sha256(f'{GEMINI_MODEL}\n{system_instruction}'.encode()).hexdigest()
+
+async def lookup_answer(runtime, prompt):
+    if runtime is None or runtime.semantic_cache is None:
+        return None, None
+    vector = await runtime.semantic_cache.embed(prompt, runtime.gemini_key, GEMINI_API_BASE)
+    if vector is None:
+        return None, None
+    return vector, runtime.semantic_cache.lookup(vector)
+
+def remember_answer(runtime, vector, response):
+    if vector is not None and response not in runtime.messages.values():
+        runtime.semantic_cache.add(vector, response)
+
+def trim_response(response):
     if len(response) > 4096:
         response = response[:4090] + "..."
-    await message.answer(response, parse_mode=ParseMode.MARKDOWN)
+    return response
+
+async def send_reply(bot, runtime, message, text):
+    method = message.answer(text, parse_mode=ParseMode.MARKDOWN)
+    if runtime and runtime.sender:
+        return await runtime.sender.send(method, message.chat.id)
+    return await bot(method)
+
+@contextlib.asynccontextmanager
+async def keep_typing(bot, runtime, chat_id):
+    if runtime and runtime.sender:
+        async with runtime.sender.keep_action(chat_id):
+            yield
+    else:
+        await bot.send_chat_action(chat_id, 'typing')
+        yield
+
+def log_transcript(runtime, message, user_id, prompt, response, source, started):
+    if TRANSCRIPTS and runtime:
+        Transcripts.record(
+            runtime.bot_id, message.chat.id, user_id, message.message_id,
+            prompt, response, source, time.monotonic() - started
+        )
+
+async def cmd_start(message: types.Message, bot: Bot, runtime=None):
+    messages = runtime.messages if runtime else MESSAGES
+    await send_reply(bot, runtime, message, messages['welcome'])
+
+async def handle_message(message: types.Message, bot: Bot, runtime=None):
+    has_media = Media.get_attachment(message) is not None
+    if not message.text and not has_media:
+        return
+
+    started = time.monotonic()
+    gemini_key = runtime.gemini_key if runtime else None
+    system_instruction = runtime.system_instruction if runtime else None
+    messages = runtime.messages if runtime else MESSAGES
+    user_id = message.from_user.id if message.from_user else message.chat.id
+    account = (runtime.bot_id, user_id) if runtime else None
+
+    if runtime and await Usage.is_over_budget(runtime.bot_id, user_id):
+        await send_reply(bot, runtime, message, messages['budget_exceeded'])
+        log_transcript(runtime, message, user_id, message.text or message.caption, None, 'over_budget', started)
+        return
+
+    vector = None
+    if not has_media:
+        vector, answer = await lookup_answer(runtime, message.text)
+        if answer is not None:
+            await send_reply(bot, runtime, message, trim_response(answer))
+            log_transcript(runtime, message, user_id, message.text, answer, 'semantic_cache', started)
+            return
+
+    if runtime and runtime.queue and not has_media:
+        runtime.sender.send_action(message.chat.id)
+        job_key = runtime.queue.enqueue(runtime.bot_id, message.chat.id, user_id, message.message_id, message.text)
+        if vector is not None:
+            # Cached once the worker has answered, see BotRuntime.collect_answers
+            runtime.queued_vectors[job_key] = vector
+            if len(runtime.queued_vectors) > QUEUE_ANSWER_LIMIT:
+                del runtime.queued_vectors[next(iter(runtime.queued_vectors))]
+        return
+
+    async with keep_typing(bot, runtime, message.chat.id):
+        if has_media:
+            async with Media.get_media_limit():
+                response = await generate_media_response(bot, message, gemini_key, system_instruction, messages, account)
+        else:
+            response = await generate_gemini_response(
+                message.text, gemini_key, system_instruction, messages=messages, account=account
+            )
+    remember_answer(runtime, vector, response)
+    await send_reply(bot, runtime, message, trim_response(response))
+    log_transcript(runtime, message, user_id, message.caption if has_media else message.text, response, 'media' if has_media else 'gemini', started)
+
+def get_inline_result(text, response):
+    return types.InlineQueryResultArticle(
+        id=hashlib.md5(response.encode()).hexdigest(),
+        title=text[:64],
+        description=response[:100],
+        input_message_content=types.InputTextMessageContent(
+            message_text=trim_response(response),
+            parse_mode=ParseMode.MARKDOWN
+        )
+    )
+
+async def answer_inline_query(inline_query, bot, runtime, text, user_id, started):
+    # Cancelled here when the user keeps typing, so only a finished query reaches Gemini
+    await asyncio.sleep(INLINE_DEBOUNCE)
+
+    key = ' '.join(text.lower().split())
+    cached = runtime.inline_cache.get(key)
+    if cached and cached[0] > time.monotonic():
+        response, source = cached[1], 'inline_cache'
+    else:
+        vector, response = await lookup_answer(runtime, text)
+        source = 'semantic_cache'
+        if response is None:
+            response = await generate_gemini_response(
+                text, runtime.gemini_key, runtime.system_instruction,
+                messages=runtime.messages, account=(runtime.bot_id, user_id)
+            )
+            remember_answer(runtime, vector, response)
+            source = 'inline'
+
+    cacheable = response not in runtime.messages.values()
+    if cacheable and source != 'inline_cache':
+        runtime.inline_cache.pop(key, None)
+        runtime.inline_cache[key] = (time.monotonic() + INLINE_CACHE_TTL, response)
+        if len(runtime.inline_cache) > INLINE_CACHE_SIZE:
+            del runtime.inline_cache[next(iter(runtime.inline_cache))]
+
+    try:
+        await bot.answer_inline_query(
+            inline_query.id, [get_inline_result(text, response)],
+            cache_time=INLINE_CACHE_TTL if cacheable else 0
+        )
+    except TelegramAPIError:
+        return  # The query expired while Gemini was answering, the answer stays cached for the next one
+    if TRANSCRIPTS:
+        Transcripts.record(runtime.bot_id, None, user_id, None, text, response, source, time.monotonic() - started)
+
+async def handle_inline_query(inline_query: types.InlineQuery, bot: Bot, runtime=None):
+    text = inline_query.query.strip()
+    if runtime is None or not text:
+        return
+
+    started = time.monotonic()
+    user_id = inline_query.from_user.id
+    if await Usage.is_over_budget(runtime.bot_id, user_id):
+        result = get_inline_result(text, runtime.messages['budget_exceeded'])
+        try:
+            await bot.answer_inline_query(inline_query.id, [result], cache_time=0, is_personal=True)
+        except TelegramAPIError:
+            pass  # Superseded by the next keystroke's query
+        return
+
+    # Telegram sends a query per keystroke, a newer one from the same user supersedes the older
+    previous = runtime.inline_queries.get(user_id)
+    if previous:
+        previous.cancel()
+    task = asyncio.ensure_future(answer_inline_query(inline_query, bot, runtime, text, user_id, started))
+    runtime.inline_queries[user_id] = task
+    try:
+        await asyncio.wait([task])
+    except asyncio.CancelledError:
+        task.cancel()
+        raise
+    finally:
+        if runtime.inline_queries.get(user_id) is task:
+            del runtime.inline_queries[user_id]
+    if not task.cancelled():
+        task.result()
+
+def create_dispatcher(**kwargs):
+    dispatcher = Dispatcher(**kwargs)
+    dispatcher.message.middleware(Diagnostics.time_handler)
+    dispatcher.inline_query.middleware(Diagnostics.time_handler)
+    dispatcher.message.register(cmd_start, Command("start"))
+    dispatcher.message.register(handle_message)
+    dispatcher.inline_query.register(handle_inline_query)
+    return dispatcher
+
+class BotRuntime:
+    def __init__(self, telegram_token, gemini_key, messages=None, system_instruction=''):
+        self.telegram_token = telegram_token
+        self.gemini_key = gemini_key
+        self.messages = {**MESSAGES, **(messages or {})}
+        self.system_instruction = system_instruction
+        self.bot_id = Store.get_bot_id(telegram_token)
+        self.loop = None
+        self.bot = None
+        self.dispatcher = None
+        self.store = None
+        self.queue = None
+        self.sender = None
+        self.semantic_cache = None
+        self.in_flight = {}
+        self.inline_queries = {}  # user_id -> task answering that user's latest inline query
+        self.inline_cache = {}  # normalized query -> (expires, response)
+        self.queued_vectors = {}  # job_key -> embedding of a prompt answered by a queue worker
+        self.last_update_id = None
+        self.stop_requested = False
+        self.cached_instruction = None  # Instruction whose context cache this runtime holds while running
+        self.username = None
+        self.error = None  # Rejected token or key, the bot can't start
+        self.warning = None  # API unreachable or failing at startup, the bot runs degraded
+
+    async def track_update(self, handler, update, data):
+        update_id = update.update_id
+        if self.store.check_reset(update_id):
+            self.last_update_id = None  # Ids restarted lower while the bot was running
+        if self.last_update_id is None or update_id > self.last_update_id:
+            self.last_update_id = update_id
+        if update_id in self.in_flight or update_id in self.store:
+            return None  # Redelivered while still being answered, or already answered before a restart
+
+        self.in_flight[update_id] = asyncio.current_task()
+        try:
+            result = await handler(update, data)
+        except Exception:
+            self.store.add(update_id)  # A failing update is not retried after every restart
+            raise
+        finally:
+            del self.in_flight[update_id]
+        # Marked once answered, a duplicate delivered meanwhile is caught by in_flight
+        self.store.add(update_id)
+        return result
+
+    async def collect_answers(self):
+        # Queue workers can't share this process's cache index, their answers are added here
+        while True:
+            await asyncio.sleep(QUEUE_ANSWER_INTERVAL)
+            if not self.queued_vectors:
+                continue
+            try:
+                answers = self.queue.answers(list(self.queued_vectors))
+            except Exception:
+                continue  # Database busy with other processes, tried again on the next pass
+            for job_key, response in answers:
+                vector = self.queued_vectors.pop(job_key, None)
+                if response is not None:
+                    remember_answer(self, vector, response)
+
+    async def prepare(self):
+        # Checks both tokens and leaves warm connections to both APIs in the pools
+        if self.bot is None:
+            self.bot = Bot(token=self.telegram_token)
+        (self.username, *telegram_check), gemini_check = await asyncio.gather(
+            check_telegram_token(self.bot), check_gemini_key(self.gemini_key)
+        )
+        # A transient failure still starts the bot, it answers with api_error until the API recovers
+        error, fatal = pick_error(telegram_check, gemini_check)
+        self.error = error if fatal else None
+        self.warning = None if fatal else error
+        return self.error
+
+    async def run(self, handle_signals=False):
+        self.loop = asyncio.get_running_loop()
+        Diagnostics.register_loop(self.loop)
+        if self.username is None or self.error:
+            if await self.prepare():
+                await self.bot.session.close()
+                raise RuntimeError(self.error)
+        self.dispatcher = create_dispatcher(runtime=self)
+        self.dispatcher.update.outer_middleware(self.track_update)
+        self.store = Store.UpdateStore(self.bot_id)
+        self.sender = Sender.Sender(self.bot, Jobs.get_rate(QUEUE_WORKERS) if QUEUE_WORKERS else Sender.GLOBAL_RATE)
+        self.sender.start()
+        self.cached_instruction = self.system_instruction
+        use_context_cache(self.gemini_key, self.cached_instruction)
+        collector = None
+        try:
+            # Set up inside the try, so a failure here still closes the sender and the store
+            if SEMANTIC_CACHE and SemanticCache.np is not None:
+                self.semantic_cache = SemanticCache.SemanticCache(
+                    os.path.join(SemanticCache.CACHE_DIR, self.bot_id),
+                    get_cache_namespace(self.system_instruction)
+                )
+            if QUEUE_WORKERS:
+                Jobs.start_workers(QUEUE_WORKERS)
+                self.queue = Jobs.JobQueue()
+                self.queue.register_bot(self)
+                if self.semantic_cache:
+                    collector = asyncio.create_task(self.collect_answers())
+
+            if self.store.offset is not None:
+                # Peeks first, confirming a stale offset would delete updates whose ids were restarted lower
+                updates = await self.bot.get_updates(limit=1, timeout=0)
+                if updates:
+                    self.store.check_reset(updates[0].update_id)
+            if self.store.offset is not None:
+                # Confirms everything handled before the last shutdown so Telegram won't resend it
+                await self.bot.get_updates(offset=self.store.offset, limit=1, timeout=0)
+
+            if not self.stop_requested:
+                await self.dispatcher.start_polling(
+                    self.bot,
+                    handle_signals=handle_signals,
+                    close_bot_session=False
+                )
+        finally:
+            await self.drain()
+            if collector:
+                collector.cancel()
+            await self.sender.close()
+            self.store.close()
+            if self.semantic_cache:
+                self.semantic_cache.close()
+                self.semantic_cache = None
+            if self.queue:
+                self.queue.close()
+                self.queue = None
+            await self.bot.session.close()
+            instruction, self.cached_instruction = self.cached_instruction, None
+            await release_context_cache(self.gemini_key, instruction)
+
+    async def drain(self, timeout=DRAIN_TIMEOUT):
+        # aiogram confirms a batch as soon as it hands it out, so updates still running after
+        # the timeout are cancelled and dropped, Telegram won't deliver them again
+        if self.in_flight:
+            done, pending = await asyncio.wait(list(self.in_flight.values()), timeout=timeout)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if self.last_update_id is not None:
+            self.store.save_offset(self.last_update_id + 1)
+
+    async def shutdown(self):
+        self.stop_requested = True
+        if self.dispatcher:
+            try:
+                await self.dispatcher.stop_polling()
+            except RuntimeError:
+                pass  # Polling has not started yet or already finished
+
+    def stop(self):
+        self.stop_requested = True
+        if self.loop and self.loop.is_running():
+            asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop)
+
+    async def switch_context_cache(self, instruction):
+        # The replaced instruction's cache would otherwise stay billed until its TTL runs out
+        if self.cached_instruction is None or self.cached_instruction == instruction:
+            return
+        use_context_cache(self.gemini_key, instruction)
+        previous, self.cached_instruction = self.cached_instruction, instruction
+        await release_context_cache(self.gemini_key, previous)
+
+    def apply_settings(self, messages=None, system_instruction=None):
+        # Takes effect for the next message, polling keeps running
+        if messages is not None:
+            self.messages = {**MESSAGES, **messages}
+        if system_instruction is not None and system_instruction != self.system_instruction:
+            self.system_instruction = system_instruction
+            if self.semantic_cache and self.loop:
+                self.loop.call_soon_threadsafe(self.semantic_cache.clear, get_cache_namespace(system_instruction))
+            if self.loop:
+                self.loop.call_soon_threadsafe(self.inline_cache.clear)
+            if self.loop and self.loop.is_running():
+                asyncio.run_coroutine_threadsafe(self.switch_context_cache(system_instruction), self.loop)
+        if self.queue and self.loop:
+            self.loop.call_soon_threadsafe(self.queue.register_bot, self)
 
 async def main():
-    global bot
-    
     if __name__ == '__main__':
         if not DEFAULT_API_TOKEN:
             print("Error: Please set DEFAULT_API_TOKEN before running directly")
             return
-        bot = Bot(token=DEFAULT_API_TOKEN)
+        runtime = BotRuntime(DEFAULT_API_TOKEN, GEMINI_API_KEY)
     else:
-        bot = Bot(token=API_TOKEN)
+        runtime = BotRuntime(API_TOKEN, GEMINI_API_KEY)
     
-    await dp.start_polling(bot)
+    Diagnostics.install_signal_handlers()
+    try:
+        if await runtime.prepare():
+            print(f"Error: {runtime.error}")
+            await runtime.bot.session.close()
+            return
+        if runtime.warning:
+            print(f"Warning: {runtime.warning}, starting anyway")
+        print(f"@{runtime.username or runtime.bot_id} is ready")
+        await runtime.run(handle_signals=True)
+    finally:
+        await close_gemini_session()
+        Jobs.stop_workers()
 
 if __name__ == '__main__':
-    import asyncio
     asyncio.run(main())
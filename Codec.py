@@ -0,0 +1,22 @@
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+NAME = 'orjson' if orjson else 'json'
+
+def dumps(data):
+    if orjson:
+        return orjson.dumps(data)
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+def dumps_text(data):
+    # aiohttp's json_serialize expects a str
+    return dumps(data).decode()
+
+def loads(data):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,197 @@
+import asyncio
+import io
+import json
+import os
+import platform
+import signal
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+import weakref
+import zipfile
+from collections import Counter
+
+SNAPSHOT_DIR = 'diagnostics'
+SAMPLE_INTERVAL = 0.005  # Seconds between stack samples while profiling
+SAMPLE_DEPTH = 40
+TRACEMALLOC_FRAMES = 10
+TOP_ALLOCATIONS = 50
+TOP_STACKS = 200
+
+enabled = False  # Checked by the handler timer, nothing else runs while diagnostics are off
+started_at = None
+samples = Counter()  # collapsed stack -> number of samples
+handler_timings = {}  # handler name -> [calls, total seconds, slowest call]
+loops = weakref.WeakSet()
+sampler = None
+lock = threading.Lock()
+
+def register_loop(loop):
+    loops.add(loop)
+
+async def time_handler(handler, event, data):
+    if not enabled:
+        return await handler(event, data)
+
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        elapsed = time.perf_counter() - started
+        callback = getattr(data.get('handler'), 'callback', None)
+        name = getattr(callback, '__qualname__', type(event).__name__)
+        with lock:
+            timing = handler_timings.setdefault(name, [0, 0.0, 0.0])
+            timing[0] += 1
+            timing[1] += elapsed
+            timing[2] = max(timing[2], elapsed)
+
+class Sampler(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name='diagnostics-sampler', daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        own_id = threading.get_ident()
+        names = {}
+        while not self.stopped.wait(self.interval):
+            for thread in threading.enumerate():
+                names[thread.ident] = thread.name
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame and len(stack) < SAMPLE_DEPTH:
+                    code = frame.f_code
+                    stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                with lock:
+                    samples[';'.join(reversed(stack))] += 1
+
+def start(interval=SAMPLE_INTERVAL):
+    global enabled, started_at, sampler
+
+    if enabled:
+        return
+    with lock:
+        samples.clear()
+        handler_timings.clear()
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    sampler = Sampler(interval)
+    sampler.start()
+    started_at = time.time()
+    enabled = True
+
+def stop():
+    global enabled, sampler
+
+    if not enabled:
+        return
+    enabled = False
+    sampler.stopped.set()
+    sampler.join()
+    sampler = None
+    tracemalloc.stop()
+
+def toggle():
+    if enabled:
+        stop()
+    else:
+        start()
+    return enabled
+
+def format_tasks():
+    output = io.StringIO()
+    for loop in list(loops):
+        if loop.is_closed():
+            continue
+        # Read from another thread without stopping the loop, so a stuck loop can be inspected too
+        for _ in range(3):
+            try:
+                tasks = list(asyncio.all_tasks(loop))
+                break
+            except RuntimeError:
+                tasks = []
+        output.write(f'Loop {id(loop):#x}: {len(tasks)} tasks\n\n')
+        for task in tasks:
+            output.write(f'{task.get_name()}: {task.get_coro()!r}\n')
+            task.print_stack(limit=SAMPLE_DEPTH, file=output)
+            output.write('\n')
+    return output.getvalue()
+
+def format_threads():
+    names = {thread.ident: thread.name for thread in threading.enumerate()}
+    output = io.StringIO()
+    for thread_id, frame in sys._current_frames().items():
+        output.write(f'Thread {names.get(thread_id, thread_id)}:\n')
+        output.write(''.join(traceback.format_stack(frame)))
+        output.write('\n')
+    return output.getvalue()
+
+def format_profile():
+    # Collapsed stacks, one per line, readable by flamegraph.pl and speedscope
+    with lock:
+        return ''.join(f'{stack} {count}\n' for stack, count in samples.most_common(TOP_STACKS))
+
+def format_allocations():
+    if not tracemalloc.is_tracing():
+        return 'tracemalloc is off, start profiling to trace allocations\n'
+    current, peak = tracemalloc.get_traced_memory()
+    output = io.StringIO()
+    output.write(f'Traced memory: {current / 1048576:.1f} MiB, peak {peak / 1048576:.1f} MiB\n\n')
+    for stat in tracemalloc.take_snapshot().statistics('lineno')[:TOP_ALLOCATIONS]:
+        output.write(f'{stat}\n')
+    return output.getvalue()
+
+def get_summary():
+    with lock:
+        timings = {
+            name: {'calls': calls, 'avg_ms': round(total / calls * 1000, 2), 'max_ms': round(slowest * 1000, 2)}
+            for name, (calls, total, slowest) in handler_timings.items()
+        }
+    return {
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'pid': os.getpid(),
+        'python': sys.version,
+        'platform': platform.platform(),
+        'profiling': enabled,
+        'profiling_since': started_at if enabled else None,
+        'threads': threading.active_count(),
+        'loops': len(loops),
+        'samples': sum(samples.values()),
+        'handlers': timings
+    }
+
+def snapshot(directory=SNAPSHOT_DIR, prefix='snapshot'):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f'{prefix}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}.zip')
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as bundle:
+        bundle.writestr('summary.json', json.dumps(get_summary(), indent=4))
+        bundle.writestr('tasks.txt', format_tasks())
+        bundle.writestr('threads.txt', format_threads())
+        bundle.writestr('profile.txt', format_profile())
+        bundle.writestr('allocations.txt', format_allocations())
+    return path
+
+def install_signal_handlers(on_snapshot=None, on_toggle=None):
+    # SIGUSR1 writes a snapshot and SIGUSR2 toggles profiling, Windows only has Ctrl+Break for snapshots
+    def handle_snapshot(signum, frame):
+        print(f"Diagnostics snapshot written to {snapshot()}")
+        if on_snapshot:
+            on_snapshot()
+
+    def handle_toggle(signum, frame):
+        print(f"Profiling {'started' if toggle() else 'stopped'}")
+        if on_toggle:
+            on_toggle()
+
+    if hasattr(signal, 'SIGUSR1'):
+        signal.signal(signal.SIGUSR1, handle_snapshot)
+        signal.signal(signal.SIGUSR2, handle_toggle)
+    elif hasattr(signal, 'SIGBREAK'):
+        signal.signal(signal.SIGBREAK, handle_snapshot)
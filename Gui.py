@@ -1,117 +1,210 @@
 import asyncio
 import json
+import multiprocessing
 import os
 from pathlib import Path
 import sys
+import threading
 import winreg
 
 import markdown
 import nest_asyncio
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
-from PyQt6.QtGui import QImage, QPainter, QPixmap, QIcon
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QSortFilterProxyModel, QThread, QTimer, pyqtSignal
+from PyQt6.QtGui import QColor, QImage, QPainter, QPixmap, QIcon
 from PyQt6.QtWidgets import (
+    QAbstractItemView,
     QApplication,
+    QComboBox,
     QFrame,
     QGridLayout,
     QGroupBox,
     QHBoxLayout,
     QLabel,
     QLineEdit,
+    QListView,
     QMainWindow,
     QMessageBox,
     QPushButton,
-    QTabWidget,
     QTextEdit,
     QVBoxLayout,
     QWidget,
     QDialog,
 )
 
-from Bot import bot, dp, generate_gemini_response, MESSAGES
+import Diagnostics
+import Jobs
+import Store
+import Supervisor
+from Bot import BotRuntime, DRAIN_TIMEOUT, VALIDATE_TIMEOUT, check_bots, close_gemini_session, generate_gemini_response, MESSAGES
 
 nest_asyncio.apply()
 
+stopping_threads = {}  # bot id -> BotThread still draining after a stop
+
 class BotThread(QThread):
     error_occurred = pyqtSignal(str)
     
-    def __init__(self, telegram_token, gemini_token):
+    def __init__(self, telegram_token, gemini_token, messages=None, system_instruction=""):
         super().__init__()
-        self.telegram_token = telegram_token
-        self.gemini_token = gemini_token
+        self.runtime = BotRuntime(telegram_token, gemini_token, messages, system_instruction)
         self._is_running = True
         self.loop = None
-        self.bot = None
     
     def run(self):
         try:
-            import Bot
-            
-            Bot.API_TOKEN = self.telegram_token
-            Bot.GEMINI_API_KEY = self.gemini_token
-            Bot.GEMINI_API_URL = f'https://generativelanguage.googleapis.com/v1beta/models/gemini-1.5-flash:generateContent?key={self.gemini_token}'
-            
-            self.bot = Bot.Bot(token=self.telegram_token)
-            Bot.bot = self.bot
-            Bot.dp = Bot.Dispatcher()
-            
-            @Bot.dp.message(Bot.Command("start"))
-            async def cmd_start(message: Bot.types.Message):
-                await message.answer(Bot.WELCOME_MESSAGE, parse_mode=Bot.ParseMode.MARKDOWN)
-
-            @Bot.dp.message()
-            async def handle_message(message: Bot.types.Message):
-                user_input = message.text
-                await self.bot.send_chat_action(message.chat.id, 'typing')
-                response = await Bot.generate_gemini_response(user_input)
-                if len(response) > 4096:
-                    response = response[:4090] + "..."
-                await message.answer(response, parse_mode=Bot.ParseMode.MARKDOWN)
-            
             self.loop = asyncio.new_event_loop()
             asyncio.set_event_loop(self.loop)
             
             while self._is_running:
                 try:
-                    self.loop.run_until_complete(Bot.dp.start_polling(self.bot))
+                    self.loop.run_until_complete(self.runtime.run())
                 except Exception as e:
                     if not self._is_running:
                         break
                     self.error_occurred.emit(str(e))
                     break
             
-            if self.bot and hasattr(self.bot, 'session'):
-                self.loop.run_until_complete(self.bot.session.close())
-            
-            Bot.bot = None
-            Bot.dp = Bot.Dispatcher()
-            self.bot = None
+            self.loop.run_until_complete(close_gemini_session())
+            self.loop.close()
                 
         except Exception as e:
             self.error_occurred.emit(str(e))
     
     def stop(self):
         self._is_running = False
-        if self.bot and hasattr(self.bot, 'session'):
-            asyncio.run_coroutine_threadsafe(self.bot.session.close(), self.loop)
+        self.runtime.stop()
+    
+    def update_settings(self, messages, system_instruction):
+        self.runtime.apply_settings(messages, system_instruction)
+
+class TokenCheckThread(QThread):
+    checked = pyqtSignal(list)
+
+    def __init__(self, bots):
+        super().__init__()
+        self.bots = bots
+
+    def run(self):
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(check_bots(self.bots))
+            loop.run_until_complete(close_gemini_session())
+        except Exception as e:
+            results = [(None, str(e), False)] * len(self.bots)
+        finally:
+            loop.close()
+        self.checked.emit([bot + result for bot, result in zip(self.bots, results)])
+
+STATUS_COLORS = {
+    "stopped": "#3c3f44",
+    "ready": "#3c3f44",
+    "starting": "#f1c40f",
+    "running": "#2ecc71",
+    "error": "#e74c3c"
+}
+
+STATUS_FILTERS = {
+    "All Bots": None,
+    "Running": {"running", "starting"},
+    "Stopped": {"stopped", "ready"},
+    "Errors": {"error"}
+}
 
 class BotConfig:
-    def __init__(self, name):
-        self.name = name
-        self.telegram_token = ""
-        self.gemini_token = ""
+    def __init__(self, name, settings=None):
+        settings = settings or {}
+        self.name = settings.get("name", name)
+        self.telegram_token = settings.get("telegram_token", "")
+        self.gemini_token = settings.get("gemini_token", "")
+        self.messages = dict(settings.get("messages") or MESSAGES)
+        self.system_instruction = settings.get("system_instruction", "")
         self.thread = None
         self.is_active = False
+        self.status = "stopped"
+        self.status_text = ""
+        self.checked_tokens = None
+        self.token_error = None
+
+    def get_settings(self):
+        return {
+            "name": self.name,
+            "telegram_token": self.telegram_token,
+            "gemini_token": self.gemini_token,
+            "messages": dict(self.messages),
+            "system_instruction": self.system_instruction
+        }
+
+class BotListModel(QAbstractListModel):
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.bots = []
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.bots)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        bot = self.bots[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return bot.name or "Unnamed Bot"
+        if role == Qt.ItemDataRole.DecorationRole:
+            return QColor(STATUS_COLORS[bot.status])
+        if role == Qt.ItemDataRole.ToolTipRole:
+            return bot.status_text or None
+        return None
+
+    def set_bots(self, bots):
+        self.beginResetModel()
+        self.bots = bots
+        self.endResetModel()
+
+    def add_bot(self, bot):
+        row = len(self.bots)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.bots.append(bot)
+        self.endInsertRows()
+        return self.index(row)
 
-class BotTab(QWidget):
-    def __init__(self, parent=None, name="New Bot"):
+    def remove_bot(self, bot):
+        row = self.bots.index(bot)
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.bots[row]
+        self.endRemoveRows()
+
+    def set_status(self, bot, status, text=""):
+        if (bot.status, bot.status_text) != (status, text):
+            bot.status = status
+            bot.status_text = text
+            self.bot_changed(bot)
+
+    def bot_changed(self, bot):
+        index = self.index(self.bots.index(bot))
+        self.dataChanged.emit(index, index)
+
+class BotFilterModel(QSortFilterProxyModel):
+    def __init__(self, parent=None):
         super().__init__(parent)
-        self.name = name
-        self.is_active = False
-        self.thread = None
+        self.statuses = None
+        self.setFilterCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+
+    def set_statuses(self, statuses):
+        self.statuses = statuses
+        self.invalidateFilter()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if self.statuses and self.sourceModel().bots[source_row].status not in self.statuses:
+            return False
+        return super().filterAcceptsRow(source_row, source_parent)
+
+class BotEditor(QWidget):
+    def __init__(self, bot, parent=None):
+        super().__init__(parent)
+        self.bot = bot
         self.has_unsaved_changes = False
-        self.bot_messages = dict(MESSAGES)
         self.setup_ui()
         self.save_initial_state()
+        self.update_status()
 
     def setup_ui(self):
         layout = QVBoxLayout(self)
@@ -119,13 +212,13 @@ class BotTab(QWidget):
         settings_layout = QGridLayout()
         
         name_label = QLabel("Bot Name:")
-        self.name_input = QLineEdit(self.name)
+        self.name_input = QLineEdit(self.bot.name)
         self.name_input.textChanged.connect(self.on_settings_changed)
         settings_layout.addWidget(name_label, 0, 0)
         settings_layout.addWidget(self.name_input, 0, 1)
         
         telegram_label = QLabel("Telegram Token:")
-        self.telegram_input = QLineEdit()
+        self.telegram_input = QLineEdit(self.bot.telegram_token)
         self.telegram_input.setPlaceholderText("Enter Telegram Bot Token")
         self.telegram_input.setEchoMode(QLineEdit.EchoMode.Password)
         self.telegram_input.textChanged.connect(self.on_settings_changed)
@@ -138,7 +231,7 @@ class BotTab(QWidget):
         settings_layout.addWidget(show_telegram, 1, 2)
         
         gemini_label = QLabel("Gemini Token:")
-        self.gemini_input = QLineEdit()
+        self.gemini_input = QLineEdit(self.bot.gemini_token)
         self.gemini_input.setPlaceholderText("Enter Gemini API Key")
         self.gemini_input.setEchoMode(QLineEdit.EchoMode.Password)
         self.gemini_input.textChanged.connect(self.on_settings_changed)
@@ -152,18 +245,8 @@ class BotTab(QWidget):
         
         control_layout = QHBoxLayout()
         
-        self.status_indicator = QLabel()
-        self.status_indicator.setFixedSize(12, 12)
-        self.status_indicator.setStyleSheet("""
-            QLabel {
-                background-color: #3c3f44;
-                border-radius: 6px;
-            }
-        """)
-        
         self.start_button = QPushButton("Start Bot")
         self.stop_button = QPushButton("Stop Bot")
-        self.stop_button.setEnabled(False)
         self.settings_button = QPushButton("More Settings")
         self.settings_button.clicked.connect(self.show_settings)
         self.save_button = QPushButton("Save Settings")
@@ -173,15 +256,19 @@ class BotTab(QWidget):
         self.stop_button.clicked.connect(self.stop_bot)
         self.save_button.clicked.connect(self.save_settings)
         
-        control_layout.addWidget(self.status_indicator)
         control_layout.addWidget(self.start_button)
         control_layout.addWidget(self.stop_button)
         control_layout.addWidget(self.settings_button)
         control_layout.addWidget(self.save_button)
         control_layout.addStretch()
         
+        self.status_label = QLabel()
+        self.status_label.setStyleSheet("color: #a0a0a0; font-weight: normal;")
+        self.status_label.setWordWrap(True)
+        
         layout.addLayout(settings_layout)
         layout.addLayout(control_layout)
+        layout.addWidget(self.status_label)
         layout.addStretch()
 
     def save_initial_state(self):
@@ -205,84 +292,52 @@ class BotTab(QWidget):
         if isinstance(main_window, ChatWindow):
             main_window.update_input_state()
 
+    def get_tokens(self):
+        return self.telegram_input.text().strip(), self.gemini_input.text().strip()
+
+    def update_status(self):
+        # Status lives in the bot list model, the editor only mirrors it
+        self.start_button.setEnabled(not self.bot.is_active)
+        self.stop_button.setEnabled(self.bot.is_active)
+        self.telegram_input.setEnabled(not self.bot.is_active)
+        self.gemini_input.setEnabled(not self.bot.is_active)
+        self.status_label.setText(self.bot.status_text)
+
     def start_bot(self):
-        if not self.telegram_input.text().strip():
-            QMessageBox.warning(self, "Warning", "Please enter Telegram Bot Token!")
-            return
-            
-        if not self.gemini_input.text().strip():
-            QMessageBox.warning(self, "Warning", "Please enter Gemini API Key!")
-            return
-            
-        self.is_active = True
-        self.thread = BotThread(
-            self.telegram_input.text().strip(),
-            self.gemini_input.text().strip()
-        )
-        self.thread.error_occurred.connect(self.handle_error)
-        self.thread.start()
-        
-        self.start_button.setEnabled(False)
-        self.stop_button.setEnabled(True)
-        self.telegram_input.setEnabled(False)
-        self.gemini_input.setEnabled(False)
-        self.status_indicator.setStyleSheet("""
-            QLabel {
-                background-color: #2ecc71;
-                border-radius: 6px;
-            }
-        """)
+        main_window = self.window()
+        if isinstance(main_window, ChatWindow):
+            error = main_window.start_bot(self.bot, *self.get_tokens())
+            if error:
+                QMessageBox.warning(self, "Warning", error)
 
     def stop_bot(self):
-        if self.thread:
-            self.thread.stop()
-            self.thread.wait()
-            self.thread = None
-        
-        self.is_active = False
-        self.start_button.setEnabled(True)
-        self.stop_button.setEnabled(False)
-        self.telegram_input.setEnabled(True)
-        self.gemini_input.setEnabled(True)
-        self.status_indicator.setStyleSheet("""
-            QLabel {
-                background-color: #3c3f44;
-                border-radius: 6px;
-            }
-        """)
-
-    def handle_error(self, error_message):
-        QMessageBox.critical(self, "Error", f"Bot error: {error_message}")
-        self.stop_bot()
+        main_window = self.window()
+        if isinstance(main_window, ChatWindow):
+            main_window.stop_bot(self.bot)
 
     def save_settings(self):
-        settings = {
-            "name": self.name_input.text().strip(),
-            "telegram_token": self.telegram_input.text().strip(),
-            "gemini_token": self.gemini_input.text().strip(),
-            "messages": {
-                'welcome': MESSAGES['welcome'],
-                'no_api_key': MESSAGES['no_api_key'],
-                'api_error': MESSAGES['api_error'],
-                'process_error': MESSAGES['process_error']
-            }
-        }
+        self.bot.name = self.name_input.text().strip()
+        self.bot.telegram_token, self.bot.gemini_token = self.get_tokens()
         
         main_window = self.window()
         if isinstance(main_window, ChatWindow):
-            main_window.save_bot_settings(self.parent().indexOf(self), settings)
+            main_window.save_bot_settings(self.bot)
             
         self.save_initial_state()
         self.has_unsaved_changes = False
         self.save_button.setEnabled(False)
 
     def show_settings(self):
-        dialog = SettingsDialog(self, self.bot_messages)
+        dialog = SettingsDialog(self, self.bot.messages, self.bot.system_instruction)
         if dialog.exec() == QDialog.DialogCode.Accepted:
-            self.bot_messages = dialog.get_settings()
-            if self.is_active:
-                self.stop_bot()
-                self.start_bot()
+            self.bot.messages = dialog.get_settings()
+            self.bot.system_instruction = dialog.get_system_instruction()
+            if self.bot.is_active:
+                self.bot.thread.update_settings(self.bot.messages, self.bot.system_instruction)
+            main_window = self.window()
+            if isinstance(main_window, ChatWindow):
+                # Saved right away, the Save button only covers the name and token fields
+                main_window.write_settings()
 
     def toggle_password_visibility(self, input_field):
         if input_field.echoMode() == QLineEdit.EchoMode.Password:
@@ -291,7 +346,7 @@ class BotTab(QWidget):
             input_field.setEchoMode(QLineEdit.EchoMode.Password)
 
 class SettingsDialog(QDialog):
-    def __init__(self, parent=None, messages=None):
+    def __init__(self, parent=None, messages=None, system_instruction=""):
         super().__init__(parent)
         self.setWindowTitle("Bot Settings")
         self.setMinimumWidth(500)
@@ -321,6 +376,14 @@ class SettingsDialog(QDialog):
         self.process_error_input = QLineEdit()
         self.process_error_input.setText(messages['process_error'])
         
+        media_error_label = QLabel("Media Error:")
+        self.media_error_input = QLineEdit()
+        self.media_error_input.setText(messages.get('media_error', MESSAGES['media_error']))
+        
+        budget_label = QLabel("Daily Limit Reached:")
+        self.budget_input = QLineEdit()
+        self.budget_input.setText(messages.get('budget_exceeded', MESSAGES['budget_exceeded']))
+        
         welcome_layout.addWidget(welcome_label)
         welcome_layout.addWidget(self.welcome_input)
         welcome_layout.addWidget(no_key_label)
@@ -329,8 +392,22 @@ class SettingsDialog(QDialog):
         welcome_layout.addWidget(self.api_error_input)
         welcome_layout.addWidget(process_error_label)
         welcome_layout.addWidget(self.process_error_input)
+        welcome_layout.addWidget(media_error_label)
+        welcome_layout.addWidget(self.media_error_input)
+        welcome_layout.addWidget(budget_label)
+        welcome_layout.addWidget(self.budget_input)
         welcome_group.setLayout(welcome_layout)
         
+        instruction_group = QGroupBox("System Instruction")
+        instruction_layout = QVBoxLayout()
+        
+        self.instruction_input = QTextEdit()
+        self.instruction_input.setPlaceholderText("Optional persona or instructions sent with every message")
+        self.instruction_input.setPlainText(system_instruction)
+        
+        instruction_layout.addWidget(self.instruction_input)
+        instruction_group.setLayout(instruction_layout)
+        
         buttons = QHBoxLayout()
         save_button = QPushButton("Save")
         cancel_button = QPushButton("Cancel")
@@ -342,6 +419,7 @@ class SettingsDialog(QDialog):
         buttons.addWidget(cancel_button)
         
         layout.addWidget(welcome_group)
+        layout.addWidget(instruction_group)
         layout.addLayout(buttons)
     
     def get_settings(self):
@@ -349,8 +427,13 @@ class SettingsDialog(QDialog):
             'welcome': self.welcome_input.toPlainText(),
             'no_api_key': self.no_key_input.text(),
             'api_error': self.api_error_input.text(),
-            'process_error': self.process_error_input.text()
+            'process_error': self.process_error_input.text(),
+            'media_error': self.media_error_input.text(),
+            'budget_exceeded': self.budget_input.text()
         }
+    
+    def get_system_instruction(self):
+        return self.instruction_input.toPlainText().strip()
 
 class ChatWindow(QMainWindow):
     def __init__(self):
@@ -406,21 +489,31 @@ class ChatWindow(QMainWindow):
             QTextEdit {
                 selection-background-color: #575AFD;
             }
-            QTabWidget::pane {
-                border: none;
-            }
-            QTabBar::tab {
-                background: #202126;
+            QListView {
+                background-color: #18191D;
                 color: #dcddde;
-                padding: 8px 12px;
                 border: none;
-                margin-right: 2px;
+                border-radius: 8px;
+                padding: 4px;
+                font-size: 13px;
             }
-            QTabBar::tab:selected {
+            QListView::item {
+                padding: 6px;
+                border-radius: 4px;
+            }
+            QListView::item:selected {
                 background: #292a30;
+                color: #ffffff;
             }
-            QTabBar::tab:hover {
-                background: #383942;
+            QListView::item:hover {
+                background: #202126;
+            }
+            QComboBox {
+                background-color: #202126;
+                border: 2px solid #202126;
+                border-radius: 4px;
+                padding: 6px;
+                color: #ffffff;
             }
         """)
         
@@ -430,16 +523,59 @@ class ChatWindow(QMainWindow):
         main_layout.setSpacing(10)
         main_layout.setContentsMargins(10, 10, 10, 10)
         
-        self.tab_widget = QTabWidget()
-        self.tab_widget.setTabsClosable(True)
-        self.tab_widget.setMovable(True)
-        self.tab_widget.tabCloseRequested.connect(self.close_tab)
-        
-        self.tab_widget.setCornerWidget(self.create_corner_buttons(), Qt.Corner.TopRightCorner)
-        
-        self.add_bot_tab()
-        
-        main_layout.addWidget(self.tab_widget)
+        # Bots are rows of a model, only the selected one gets an editor widget
+        self.model = BotListModel(self)
+        self.filter_model = BotFilterModel(self)
+        self.filter_model.setSourceModel(self.model)
+        self.model.dataChanged.connect(self.on_bot_changed)
+        self.editor = None
+        
+        bots_layout = QHBoxLayout()
+        list_layout = QVBoxLayout()
+        
+        filter_layout = QHBoxLayout()
+        self.search_input = QLineEdit()
+        self.search_input.setPlaceholderText("Search bots")
+        self.search_input.textChanged.connect(self.filter_model.setFilterFixedString)
+        self.status_filter = QComboBox()
+        self.status_filter.addItems(STATUS_FILTERS)
+        self.status_filter.currentTextChanged.connect(lambda text: self.filter_model.set_statuses(STATUS_FILTERS[text]))
+        filter_layout.addWidget(self.search_input)
+        filter_layout.addWidget(self.status_filter)
+        filter_layout.addWidget(self.create_header_buttons())
+        
+        self.bot_list = QListView()
+        self.bot_list.setModel(self.filter_model)
+        self.bot_list.setSelectionMode(QAbstractItemView.SelectionMode.ExtendedSelection)
+        self.bot_list.setUniformItemSizes(True)
+        self.bot_list.selectionModel().currentChanged.connect(self.on_current_bot_changed)
+        
+        bulk_layout = QHBoxLayout()
+        start_selected = QPushButton("Start")
+        start_selected.setToolTip("Start the selected bots")
+        start_selected.clicked.connect(self.start_selected_bots)
+        stop_selected = QPushButton("Stop")
+        stop_selected.setToolTip("Stop the selected bots")
+        stop_selected.clicked.connect(self.stop_selected_bots)
+        remove_selected = QPushButton("Remove")
+        remove_selected.setToolTip("Remove the selected bots")
+        remove_selected.clicked.connect(self.remove_selected_bots)
+        bulk_layout.addWidget(start_selected)
+        bulk_layout.addWidget(stop_selected)
+        bulk_layout.addWidget(remove_selected)
+        
+        list_layout.addLayout(filter_layout)
+        list_layout.addWidget(self.bot_list)
+        list_layout.addLayout(bulk_layout)
+        
+        list_widget = QWidget()
+        list_widget.setLayout(list_layout)
+        list_widget.setFixedWidth(380)
+        self.editor_layout = QVBoxLayout()
+        
+        bots_layout.addWidget(list_widget)
+        bots_layout.addLayout(self.editor_layout)
+        main_layout.addLayout(bots_layout)
         
         chat_frame = QFrame()
         chat_layout = QVBoxLayout(chat_frame)
@@ -546,25 +682,32 @@ class ChatWindow(QMainWindow):
         self.send_button.clicked.connect(self.send_message)
         self.message_input.returnPressed.connect(self.send_message)
 
-        self.tab_widget.currentChanged.connect(self.update_input_state)
+        self.supervisor = None
+        self.fleet_stopping = None
+        self.fleet_timer = QTimer(self)
+        self.fleet_timer.timeout.connect(self.update_fleet_status)
+        self.token_checks = set()
 
         self.load_settings()
+        self.check_tokens(self.model.bots)
 
-    def create_corner_buttons(self):
+    def create_header_buttons(self):
         widget = QWidget()
         layout = QHBoxLayout(widget)
         layout.setContentsMargins(0, 0, 0, 0)
         layout.setSpacing(0)
         
-        add_button = self.create_add_tab_button()
+        add_button = self.create_add_button()
+        self.fleet_button = self.create_fleet_button()
         about_button = self.create_about_button()
         
         layout.addWidget(add_button)
+        layout.addWidget(self.fleet_button)
         layout.addWidget(about_button)
         
         return widget
     
-    def create_add_tab_button(self):
+    def create_add_button(self):
         button = QPushButton("+")
         button.setStyleSheet("""
             QPushButton {
@@ -574,9 +717,193 @@ class ChatWindow(QMainWindow):
                 font-weight: bold;
             }
         """)
-        button.clicked.connect(self.add_bot_tab)
+        button.clicked.connect(self.add_bot)
         return button
     
+    def create_fleet_button(self):
+        button = QPushButton("Fleet")
+        button.setToolTip("Run all saved bots in worker processes")
+        button.setStyleSheet("""
+            QPushButton {
+                border: none;
+                padding: 5px;
+                font-size: 13px;
+                font-weight: bold;
+            }
+        """)
+        button.clicked.connect(self.toggle_fleet)
+        return button
+
+    def toggle_fleet(self):
+        if self.supervisor:
+            self.fleet_timer.stop()
+            # Shards drain in the background instead of blocking the UI
+            self.fleet_stopping = threading.Thread(target=self.supervisor.stop, name='fleet-stop')
+            self.fleet_stopping.start()
+            self.supervisor = None
+            self.fleet_button.setText("Fleet")
+            for bot in self.model.bots:
+                self.model.set_status(bot, "stopped")
+            return
+
+        if any(bot.is_active for bot in self.model.bots) or stopping_threads:
+            QMessageBox.warning(self, "Warning", "Stop the running bots before starting the fleet!")
+            return
+        if self.is_fleet_stopping():
+            QMessageBox.warning(self, "Warning", "The fleet is still stopping, try again in a few seconds!")
+            return
+
+        self.supervisor = Supervisor.Supervisor()
+        self.supervisor.start()
+        if not self.supervisor.bots:
+            self.supervisor = None
+            QMessageBox.warning(self, "Warning", "Save at least one bot with both tokens first!")
+            return
+        self.fleet_button.setText("Stop Fleet")
+        self.fleet_timer.start(1000)
+
+    def is_fleet_stopping(self):
+        return bool(self.fleet_stopping and self.fleet_stopping.is_alive())
+
+    def check_tokens(self, bots):
+        # All tokens are checked concurrently in the background, the list shows each result
+        bots = [bot for bot in bots if bot.telegram_token and bot.gemini_token]
+        if not bots:
+            return
+        thread = TokenCheckThread([(bot.telegram_token, bot.gemini_token) for bot in bots])
+        self.token_checks.add(thread)
+
+        def apply(results):
+            self.token_checks.discard(thread)
+            for bot, (telegram_token, gemini_token, username, error, fatal) in zip(bots, results):
+                if (bot.telegram_token, bot.gemini_token) != (telegram_token, gemini_token):
+                    continue
+                bot.checked_tokens = (telegram_token, gemini_token)
+                # Only rejected tokens block a start, an unreachable API leaves the bot startable
+                bot.token_error = error if fatal else None
+                if bot in self.model.bots and not bot.is_active and not self.supervisor:
+                    if fatal:
+                        self.model.set_status(bot, "error", error)
+                    else:
+                        self.model.set_status(bot, "ready", f"Degraded: {error}" if error else f"@{username} is ready")
+
+        thread.checked.connect(apply)
+        thread.start()
+
+    def update_fleet_status(self):
+        bots = self.supervisor.poll()['bots']
+        for bot in self.model.bots:
+            status = bots.get(Store.get_bot_id(bot.telegram_token)) if bot.telegram_token else None
+            if status is None:
+                self.model.set_status(bot, "stopped")
+            elif status['error']:
+                self.model.set_status(bot, "error", f"{status['shard']}: {status['error']}")
+            elif status['running']:
+                self.model.set_status(
+                    bot, "running",
+                    f"@{status['username']} on {status['shard']} (pid {status['pid']}), "
+                    f"in flight {status['in_flight']}, sent {status['sent']}"
+                    + (f", degraded: {status['warning']}" if status['warning'] else "")
+                )
+            else:
+                self.model.set_status(bot, "starting", f"{status['shard']}: starting")
+
+    def start_bot(self, bot, telegram_token, gemini_token):
+        if bot.is_active:
+            return None
+        if self.supervisor:
+            return "Saved bots are running in fleet mode, stop the fleet first!"
+        if self.is_fleet_stopping():
+            return "The fleet is still stopping, try again in a few seconds!"
+        if not telegram_token:
+            return "Please enter Telegram Bot Token!"
+        if not gemini_token:
+            return "Please enter Gemini API Key!"
+        if bot.token_error and bot.checked_tokens == (telegram_token, gemini_token):
+            return bot.token_error
+        if Store.get_bot_id(telegram_token) in stopping_threads:
+            # A second poller would get 409 Conflict and both would write the same update store row
+            return "The bot is still finishing its last replies, try again in a few seconds!"
+
+        bot.is_active = True
+        bot.thread = BotThread(telegram_token, gemini_token, bot.messages, bot.system_instruction)
+        bot.thread.error_occurred.connect(lambda error: self.handle_bot_error(bot, error))
+        bot.thread.start()
+        self.model.set_status(bot, "running", "Running")
+        return None
+
+    def stop_bot(self, bot):
+        if bot.thread:
+            # In-flight replies are drained in the background instead of blocking the UI
+            thread = bot.thread
+            bot_id = thread.runtime.bot_id
+            stopping_threads[bot_id] = thread
+
+            def finished():
+                if stopping_threads.get(bot_id) is thread:
+                    del stopping_threads[bot_id]
+
+            thread.finished.connect(finished)
+            thread.stop()
+            bot.thread = None
+        
+        bot.is_active = False
+        self.model.set_status(bot, "stopped")
+
+    def handle_bot_error(self, bot, error_message):
+        QMessageBox.critical(self, "Error", f"{bot.name}: {error_message}")
+        self.stop_bot(bot)
+        self.model.set_status(bot, "error", error_message)
+
+    def get_selected_bots(self):
+        rows = self.bot_list.selectionModel().selectedRows()
+        return [self.model.bots[self.filter_model.mapToSource(index).row()] for index in rows]
+
+    def start_selected_bots(self):
+        errors = []
+        for bot in self.get_selected_bots():
+            error = self.start_bot(bot, bot.telegram_token, bot.gemini_token)
+            if error:
+                errors.append(f"{bot.name}: {error}")
+        if errors:
+            QMessageBox.warning(self, "Warning", "\n".join(errors))
+
+    def stop_selected_bots(self):
+        for bot in self.get_selected_bots():
+            if bot.is_active:
+                self.stop_bot(bot)
+
+    def on_bot_changed(self, top_left, bottom_right):
+        if self.editor and top_left.row() <= self.model.bots.index(self.editor.bot) <= bottom_right.row():
+            self.editor.update_status()
+
+    def on_current_bot_changed(self, current, previous):
+        if not current.isValid():
+            return
+        bot = self.model.bots[self.filter_model.mapToSource(current).row()]
+        if self.editor and self.editor.bot is bot:
+            return
+        self.close_editor()
+        self.editor = BotEditor(bot)
+        self.editor_layout.addWidget(self.editor)
+        self.update_input_state()
+
+    def close_editor(self):
+        if not self.editor:
+            return
+        if self.editor.has_unsaved_changes and self.editor.bot in self.model.bots:
+            reply = QMessageBox.question(
+                self,
+                "Unsaved Changes",
+                f"There are unsaved changes in {self.editor.bot.name}. Do you want to save them?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                QMessageBox.StandardButton.Yes
+            )
+            if reply == QMessageBox.StandardButton.Yes:
+                self.editor.save_settings()
+        self.editor.deleteLater()
+        self.editor = None
+
     def create_about_button(self):
         button = QPushButton("i")
         button.setStyleSheet("""
@@ -594,56 +921,47 @@ class ChatWindow(QMainWindow):
         dialog = AboutDialog(self)
         dialog.exec()
 
-    def add_bot_tab(self):
-        tab = BotTab(self.tab_widget, f"Bot {self.tab_widget.count() + 1}")
-        self.tab_widget.addTab(tab, tab.name)
-        self.tab_widget.setCurrentWidget(tab)
+    def add_bot(self):
+        bot = BotConfig(f"Bot {len(self.model.bots) + 1}")
+        index = self.model.add_bot(bot)
+        self.search_input.clear()
+        self.status_filter.setCurrentIndex(0)
+        self.bot_list.setCurrentIndex(self.filter_model.mapFromSource(index))
 
-    def close_tab(self, index):
-        if self.tab_widget.count() > 1:
-            tab = self.tab_widget.widget(index)
-            
-            if tab.is_active:
-                reply = QMessageBox.question(
-                    self,
-                    "Confirm Close",
-                    "This bot is currently running. Are you sure you want to close it?",
-                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
-                    QMessageBox.StandardButton.No
-                )
-                if reply == QMessageBox.StandardButton.No:
-                    return
-                tab.stop_bot()
-            
-            if tab.has_unsaved_changes:
-                reply = QMessageBox.question(
-                    self,
-                    "Unsaved Changes",
-                    "There are unsaved changes. Do you want to save them before closing?",
-                    QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No | QMessageBox.StandardButton.Cancel,
-                    QMessageBox.StandardButton.Yes
-                )
-                if reply == QMessageBox.StandardButton.Cancel:
-                    return
-                if reply == QMessageBox.StandardButton.Yes:
-                    tab.save_settings()
-            
-            config_file = "Bot.settings"
-            if os.path.exists(config_file):
-                with open(config_file, 'r') as f:
-                    settings = json.load(f)
-                
-                if index < len(settings):
-                    settings.pop(index)
-                    with open(config_file, 'w') as f:
-                        json.dump(settings, f, indent=4)
-            
-            self.tab_widget.removeTab(index)
-        else:
-            QMessageBox.warning(self, "Warning", "Cannot close the last tab!")
+    def remove_selected_bots(self):
+        bots = self.get_selected_bots()
+        if not bots:
+            return
+        if len(bots) >= len(self.model.bots):
+            QMessageBox.warning(self, "Warning", "Cannot remove every bot!")
+            return
+        
+        running = [bot for bot in bots if bot.is_active]
+        if running:
+            reply = QMessageBox.question(
+                self,
+                "Confirm Remove",
+                f"{len(running)} of the selected bots are running. Are you sure you want to remove them?",
+                QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No,
+                QMessageBox.StandardButton.No
+            )
+            if reply == QMessageBox.StandardButton.No:
+                return
+            for bot in running:
+                self.stop_bot(bot)
+        
+        if self.editor and self.editor.bot in bots:
+            self.editor.deleteLater()
+            self.editor = None
+        for bot in bots:
+            self.model.remove_bot(bot)
+        self.write_settings()
+        if self.editor is None:
+            self.bot_list.setCurrentIndex(self.filter_model.index(0, 0))
+        self.update_input_state()
 
     def update_input_state(self):
-        current_tab = self.tab_widget.currentWidget()
+        current_tab = self.editor
         if current_tab:
             has_gemini_token = bool(current_tab.gemini_input.text().strip())
             self.message_input.setEnabled(has_gemini_token)
@@ -658,7 +976,9 @@ class ChatWindow(QMainWindow):
             self.tucnify_name.setText(f"Tucnify ({bot_name})")
 
     def send_message(self):
-        current_tab = self.tab_widget.currentWidget()
+        current_tab = self.editor
+        if not current_tab:
+            return
         gemini_token = current_tab.gemini_input.text().strip()
         
         if not gemini_token:
@@ -674,11 +994,13 @@ class ChatWindow(QMainWindow):
         self.message_input.setEnabled(False)
         self.response_area.setText("Waiting for response...")
         
-        import Bot
-        Bot.GEMINI_API_KEY = gemini_token
-        
         loop = asyncio.get_event_loop()
-        response = loop.run_until_complete(generate_gemini_response(message))
+        response = loop.run_until_complete(generate_gemini_response(
+            message,
+            api_key=gemini_token,
+            system_instruction=current_tab.bot.system_instruction,
+            messages=current_tab.bot.messages
+        ))
         
         html = markdown.markdown(
             response,
@@ -824,68 +1146,56 @@ class ChatWindow(QMainWindow):
         
         return result
 
-    def save_bot_settings(self, index, settings):
+    def save_bot_settings(self, bot):
+        self.model.bot_changed(bot)
+        self.write_settings()
+        self.check_tokens([bot])
+        QMessageBox.information(self, "Success", "Settings saved successfully!")
+
+    def write_settings(self):
         config_file = "Bot.settings"
-        all_settings = []
-        
+        with open(config_file, 'w') as f:
+            json.dump([bot.get_settings() for bot in self.model.bots], f, indent=4)
+        if self.supervisor:
+            # Added, removed and edited bots are picked up by the running fleet
+            self.supervisor.set_bots(Supervisor.load_bots(config_file))
+
+    def load_settings(self):
+        config_file = "Bot.settings"
+        bots = []
         if os.path.exists(config_file):
             with open(config_file, 'r') as f:
                 try:
-                    all_settings = json.load(f)
+                    settings = json.load(f)
+                    bots = [BotConfig("New Bot", bot_settings) for bot_settings in settings if bot_settings]
                 except:
                     pass
         
-        while len(all_settings) <= index:
-            all_settings.append({})
-        all_settings[index] = settings
-        
-        with open(config_file, 'w') as f:
-            json.dump(all_settings, f, indent=4)
-        
-        QMessageBox.information(self, "Success", "Settings saved successfully!")
-
-    def load_settings(self):
-        config_file = "Bot.settings"
-        if not os.path.exists(config_file):
-            return
-        
-        with open(config_file, 'r') as f:
-            try:
-                settings = json.load(f)
-                self.tab_widget.clear()
-                
-                for bot_settings in settings:
-                    if bot_settings:
-                        tab = BotTab(self.tab_widget, bot_settings.get("name", "New Bot"))
-                        tab.name_input.setText(bot_settings.get("name", ""))
-                        tab.telegram_input.setText(bot_settings.get("telegram_token", ""))
-                        tab.gemini_input.setText(bot_settings.get("gemini_token", ""))
-                        
-                        if "messages" in bot_settings:
-                            tab.bot_messages = bot_settings["messages"]
-                        
-                        self.tab_widget.addTab(tab, tab.name)
-                        tab.save_initial_state()
-                        tab.has_unsaved_changes = False
-                        tab.save_button.setEnabled(False)
-                
-                if self.tab_widget.count() == 0:
-                    self.add_bot_tab()
-            except:
-                self.add_bot_tab()
+        self.model.set_bots(bots or [BotConfig("Bot 1")])
+        self.bot_list.setCurrentIndex(self.filter_model.index(0, 0))
 
     def closeEvent(self, event):
-        for i in range(self.tab_widget.count()):
-            tab = self.tab_widget.widget(i)
-            if tab.is_active:
-                tab.stop_bot()
+        for bot in self.model.bots:
+            if bot.is_active:
+                self.stop_bot(bot)
+        if self.supervisor:
+            self.fleet_timer.stop()
+            self.supervisor.stop()
+        if self.fleet_stopping:
+            self.fleet_stopping.join()
+        
+        for thread in list(stopping_threads.values()):
+            thread.wait((DRAIN_TIMEOUT + 5) * 1000)
+        for thread in list(self.token_checks):
+            thread.wait((VALIDATE_TIMEOUT + 1) * 1000)
+        Jobs.stop_workers()
         event.accept()
 
 class AboutDialog(QDialog):
     def __init__(self, parent=None):
         super().__init__(parent)
         self.setWindowTitle("About Tucnify")
-        self.setFixedSize(400, 300)
+        self.setFixedSize(400, 360)
         
         layout = QVBoxLayout(self)
         layout.setSpacing(10)
@@ -938,11 +1248,23 @@ class AboutDialog(QDialog):
         """)
         close_button.clicked.connect(self.accept)
         
+        diagnostics_layout = QHBoxLayout()
+        self.profiling_button = QPushButton()
+        self.profiling_button.setToolTip("Sample stacks, trace allocations and time handlers of the running bots")
+        self.profiling_button.clicked.connect(self.toggle_profiling)
+        snapshot_button = QPushButton("Save Snapshot")
+        snapshot_button.setToolTip(f"Write tasks, threads, profile and allocations to the {Diagnostics.SNAPSHOT_DIR} folder")
+        snapshot_button.clicked.connect(self.save_snapshot)
+        diagnostics_layout.addWidget(self.profiling_button)
+        diagnostics_layout.addWidget(snapshot_button)
+        self.update_profiling_button()
+        
         layout.addWidget(logo_label)
         layout.addWidget(title)
         layout.addWidget(version)
         layout.addWidget(description)
         layout.addWidget(links)
+        layout.addLayout(diagnostics_layout)
         layout.addWidget(close_button)
         layout.addStretch()
         
@@ -955,7 +1277,31 @@ class AboutDialog(QDialog):
             }
         """)
 
+    def get_supervisor(self):
+        # While the fleet runs the bots live in shard processes, which profile themselves
+        return getattr(self.parent(), 'supervisor', None)
+
+    def toggle_profiling(self):
+        Diagnostics.toggle()
+        supervisor = self.get_supervisor()
+        if supervisor:
+            supervisor.diagnostics('start' if Diagnostics.enabled else 'stop')
+        self.update_profiling_button()
+
+    def update_profiling_button(self):
+        self.profiling_button.setText("Stop Profiling" if Diagnostics.enabled else "Start Profiling")
+
+    def save_snapshot(self):
+        path = Diagnostics.snapshot()
+        message = f"Snapshot saved to {os.path.abspath(path)}"
+        supervisor = self.get_supervisor()
+        if supervisor:
+            supervisor.diagnostics('snapshot')
+            message += f"\nEvery fleet process writes its own snapshot to {os.path.abspath(Diagnostics.SNAPSHOT_DIR)}"
+        QMessageBox.information(self, "Diagnostics", message)
+
 def main():
+    multiprocessing.freeze_support()
     app = QApplication(sys.argv)
     window = ChatWindow()
     window.show()
@@ -0,0 +1,268 @@
+import asyncio
+import json
+import multiprocessing
+import sqlite3
+import threading
+import time
+
+from aiogram.methods import SendMessage
+
+import Sender
+import Store
+import Transcripts
+import Usage
+
+LEASE_SECONDS = 120  # A job claimed by a worker that died is retried after this
+MAX_ATTEMPTS = 5
+RETRY_DELAY = 5  # Seconds before a job whose reply failed is tried again, doubled on every attempt
+JOBS_PER_WORKER = 16  # Jobs one worker process answers at the same time
+JOB_HISTORY = 10000
+IDLE_SLEEP = 0.5
+
+workers = []
+workers_lock = threading.Lock()
+stop_event = None
+
+def connect(path=Store.STORE_FILE):
+    connection = Store.connect(path)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_key TEXT NOT NULL UNIQUE,
+            bot_id TEXT NOT NULL,
+            chat_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            message_id INTEGER NOT NULL,
+            prompt TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            locked_until REAL NOT NULL DEFAULT 0,
+            response TEXT
+        )
+    """)
+    connection.execute('CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, locked_until)')
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS job_bots (
+            bot_id TEXT PRIMARY KEY,
+            telegram_token TEXT NOT NULL,
+            gemini_key TEXT NOT NULL,
+            system_instruction TEXT NOT NULL,
+            messages TEXT NOT NULL
+        )
+    """)
+    return connection
+
+class JobQueue:
+    def __init__(self, path=Store.STORE_FILE):
+        self.connection = connect(path)
+
+    def register_bot(self, runtime):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO job_bots VALUES (?, ?, ?, ?, ?)',
+                (runtime.bot_id, runtime.telegram_token, runtime.gemini_key,
+                 runtime.system_instruction, json.dumps(runtime.messages))
+            )
+
+    def enqueue(self, bot_id, chat_id, user_id, message_id, prompt):
+        # The key makes enqueueing idempotent when Telegram delivers the same message twice
+        job_key = f'{bot_id}:{chat_id}:{message_id}'
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR IGNORE INTO jobs (job_key, bot_id, chat_id, user_id, message_id, prompt) VALUES (?, ?, ?, ?, ?, ?)',
+                (job_key, bot_id, chat_id, user_id, message_id, prompt)
+            )
+        return job_key
+
+    def answers(self, job_keys):
+        # Finished jobs as (job_key, response), the response is None for failed jobs
+        placeholders = ', '.join('?' * len(job_keys))
+        rows = self.connection.execute(
+            f"SELECT job_key, status, response FROM jobs WHERE job_key IN ({placeholders}) AND status IN ('done', 'failed')",
+            job_keys
+        ).fetchall()
+        with self.connection:
+            self.connection.executemany('UPDATE jobs SET response = NULL WHERE job_key = ?', [(row[0],) for row in rows])
+        return [(job_key, response if status == 'done' else None) for job_key, status, response in rows]
+
+    def depth(self):
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+        ).fetchone()[0]
+
+    def close(self):
+        self.connection.close()
+
+def claim_job(connection):
+    now = time.time()
+    connection.execute('BEGIN IMMEDIATE')
+    try:
+        job = connection.execute("""
+            SELECT id, bot_id, chat_id, user_id, prompt, response, attempts FROM jobs
+            WHERE status IN ('queued', 'running') AND locked_until < ?
+            ORDER BY id LIMIT 1
+        """, (now,)).fetchone()
+        if job is None:
+            connection.execute('COMMIT')
+            return None
+
+        if job[6] >= MAX_ATTEMPTS:
+            connection.execute("UPDATE jobs SET status = 'failed' WHERE id = ?", (job[0],))
+            connection.execute('COMMIT')
+            return None
+
+        connection.execute(
+            "UPDATE jobs SET status = 'running', locked_until = ?, attempts = attempts + 1 WHERE id = ?",
+            (now + LEASE_SECONDS, job[0])
+        )
+        connection.execute('COMMIT')
+        return job
+    except BaseException:
+        connection.execute('ROLLBACK')
+        raise
+
+def run_worker(path, event, rate):
+    asyncio.run(worker_loop(path, event, rate))
+
+async def worker_loop(path, event, rate):
+    import Bot
+
+    connection = connect(path)
+    connection.isolation_level = None
+    senders = {}
+    # Every job mostly waits on Gemini, so one process keeps several of them in flight
+    limit = asyncio.Semaphore(JOBS_PER_WORKER)
+    running = set()
+    try:
+        while not event.is_set():
+            await limit.acquire()
+            job = claim_job(connection)
+            if job is None:
+                limit.release()
+                await asyncio.sleep(IDLE_SLEEP)
+                continue
+            task = asyncio.create_task(run_job(connection, job, senders, rate, Bot))
+            running.add(task)
+            task.add_done_callback(running.discard)
+            task.add_done_callback(lambda task: limit.release())
+        await asyncio.gather(*running, return_exceptions=True)
+    finally:
+        for sender in senders.values():
+            await sender.close()
+            await sender.bot.session.close()
+        await Bot.close_gemini_session()
+        connection.close()
+        Usage.flush()
+        Transcripts.flush()
+
+async def run_job(connection, job, senders, rate, Bot):
+    renewing = asyncio.create_task(renew_lease(connection, job[0], job[6] + 1))
+    try:
+        await process_job(connection, job, senders, rate, Bot)
+    except Exception:
+        retry_later(connection, job[0], job[6] + 1)
+    finally:
+        renewing.cancel()
+
+async def renew_lease(connection, job_id, attempts):
+    # A slow Gemini call or RetryAfter waits must not let a second worker claim the job
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 3)
+        try:
+            connection.execute(
+                "UPDATE jobs SET locked_until = ? WHERE id = ? AND status = 'running' AND attempts = ?",
+                (time.time() + LEASE_SECONDS, job_id, attempts)
+            )
+        except sqlite3.Error:
+            pass  # Database busy, renewed on the next pass while the lease still has time left
+
+def holds_lease(connection, job_id, attempts):
+    # Every claim counts an attempt, so a changed count means another worker took the job over
+    row = connection.execute('SELECT status, attempts FROM jobs WHERE id = ?', (job_id,)).fetchone()
+    return row == ('running', attempts)
+
+def retry_later(connection, job_id, attempts):
+    # Backs off so a permanent error does not use up MAX_ATTEMPTS within milliseconds
+    connection.execute(
+        "UPDATE jobs SET status = 'queued', locked_until = ? WHERE id = ? AND attempts = ?",
+        (time.time() + RETRY_DELAY * 2 ** (attempts - 1), job_id, attempts)
+    )
+
+async def process_job(connection, job, senders, rate, Bot):
+    job_id, bot_id, chat_id, user_id, prompt, response, attempts = job
+    config = connection.execute(
+        'SELECT telegram_token, gemini_key, system_instruction, messages FROM job_bots WHERE bot_id = ?',
+        (bot_id,)
+    ).fetchone()
+    if config is None:
+        connection.execute("UPDATE jobs SET status = 'failed' WHERE id = ?", (job_id,))
+        return
+
+    telegram_token, gemini_key, system_instruction, messages = config
+    if telegram_token not in senders:
+        senders[telegram_token] = Sender.Sender(Bot.Bot(token=telegram_token), rate)
+        senders[telegram_token].start()
+
+    started = time.monotonic()
+    if response is None:
+        async with senders[telegram_token].keep_action(chat_id):
+            response = await Bot.generate_gemini_response(
+                prompt, gemini_key, system_instruction,
+                messages=json.loads(messages), account=(bot_id, user_id)
+            )
+        # Kept so a retry after a failed send does not pay for a second Gemini call
+        connection.execute('UPDATE jobs SET response = ? WHERE id = ?', (response, job_id))
+
+    if not holds_lease(connection, job_id, attempts + 1):
+        return  # Lease ran out, the worker that claimed it next sends the reply
+
+    try:
+        method = SendMessage(chat_id=chat_id, text=Bot.trim_response(response), parse_mode=Bot.ParseMode.MARKDOWN)
+        await senders[telegram_token].send(method, chat_id)
+    except Exception:
+        # Lease is released so another worker picks it up later, attempts are capped by MAX_ATTEMPTS
+        retry_later(connection, job_id, attempts + 1)
+        return
+
+    # The response is kept for the bot's semantic cache until its process collects it or the job is pruned
+    connection.execute("UPDATE jobs SET status = 'done', prompt = '' WHERE id = ?", (job_id,))
+    if Bot.TRANSCRIPTS:
+        Transcripts.record(bot_id, chat_id, user_id, None, prompt, response, 'queue', time.monotonic() - started)
+
+def get_rate(count):
+    # Workers and the bot's own process share its flood limit, each sends to the same bot
+    return Sender.GLOBAL_RATE / (count + 1)
+
+def start_workers(count, path=Store.STORE_FILE):
+    global stop_event
+
+    with workers_lock:
+        if workers:
+            return
+
+        connection = connect(path)
+        with connection:
+            # Finished jobs are only kept around as a recent history
+            connection.execute(
+                "DELETE FROM jobs WHERE status IN ('done', 'failed') AND id < (SELECT MAX(id) FROM jobs) - ?",
+                (JOB_HISTORY,)
+            )
+        connection.close()
+
+        stop_event = multiprocessing.Event()
+        rate = get_rate(count)
+        for _ in range(count):
+            process = multiprocessing.Process(target=run_worker, args=(path, stop_event, rate), daemon=True)
+            process.start()
+            workers.append(process)
+
+def stop_workers(timeout=10):
+    with workers_lock:
+        if not workers:
+            return
+        stop_event.set()
+        for process in workers:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+        workers.clear()
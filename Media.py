@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import tempfile
+import weakref
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_BYTES = 512 * 1024  # Larger downloads are spilled to a temporary file
+INLINE_MAX_BYTES = 4 * 1024 * 1024  # Larger files go through the Gemini File API
+TELEGRAM_MAX_BYTES = 20 * 1024 * 1024  # Bot API download limit
+IMAGE_MAX_SIDE = 1600
+IMAGE_QUALITY = 85
+IMAGE_MAX_PIXELS = 24 * 1000 * 1000  # Larger images are refused before their pixels are decoded
+MAX_CONCURRENT_MEDIA = 4
+FILE_POLL_ATTEMPTS = 30
+
+media_semaphores = weakref.WeakKeyDictionary()
+
+class MediaError(Exception):
+    pass
+
+class MediaFile:
+    def __init__(self, mime_type):
+        self.mime_type = mime_type
+        self.file = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+        self.size = 0
+
+    def read_chunks(self):
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        self.file.close()
+
+def get_media_limit():
+    loop = asyncio.get_running_loop()
+    if loop not in media_semaphores:
+        media_semaphores[loop] = asyncio.Semaphore(MAX_CONCURRENT_MEDIA)
+    return media_semaphores[loop]
+
+def get_attachment(message):
+    if message.photo:
+        # Telegram already offers several resolutions, take the largest one that fits
+        sizes = [size for size in message.photo if max(size.width, size.height) <= IMAGE_MAX_SIDE]
+        photo = sizes[-1] if sizes else message.photo[0]
+        return photo.file_id, 'image/jpeg', photo.file_size
+    if message.voice:
+        return message.voice.file_id, message.voice.mime_type or 'audio/ogg', message.voice.file_size
+    if message.audio:
+        return message.audio.file_id, message.audio.mime_type or 'audio/mpeg', message.audio.file_size
+    if message.document:
+        document = message.document
+        return document.file_id, document.mime_type or 'application/octet-stream', document.file_size
+    return None
+
+async def download_media(bot, message):
+    attachment = get_attachment(message)
+    if attachment is None:
+        return None
+
+    file_id, mime_type, file_size = attachment
+    if file_size and file_size > TELEGRAM_MAX_BYTES:
+        raise MediaError(f'File is too large ({file_size} bytes)')
+
+    media = MediaFile(mime_type)
+    try:
+        telegram_file = await bot.get_file(file_id)
+        await bot.download_file(telegram_file.file_path, media.file, chunk_size=CHUNK_SIZE, seek=False)
+        media.size = media.file.tell()
+
+        if Image and mime_type.startswith('image/') and not message.photo:
+            await asyncio.get_running_loop().run_in_executor(None, shrink_image, media)
+    except Exception:
+        media.close()
+        raise
+    return media
+
+def shrink_image(media):
+    media.file.seek(0)
+    try:
+        image = Image.open(media.file)  # Only reads the header, pixels are decoded by load()
+    except Exception:
+        return
+
+    if image.width * image.height > IMAGE_MAX_PIXELS:
+        raise MediaError(f'Image is too large ({image.width}x{image.height})')
+    if max(image.size) <= IMAGE_MAX_SIDE and media.size <= INLINE_MAX_BYTES:
+        return
+
+    # JPEG decodes straight at a reduced scale, so the full-size bitmap never exists in memory
+    image.draft('RGB', (IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+    try:
+        image.load()
+    except Exception:
+        return
+
+    image.thumbnail((IMAGE_MAX_SIDE, IMAGE_MAX_SIDE))
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+
+    compressed = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES)
+    image.save(compressed, format='JPEG', quality=IMAGE_QUALITY, optimize=True)
+    media.file.close()
+    media.file = compressed
+    media.size = compressed.tell()
+    media.mime_type = 'image/jpeg'
+
+async def build_part(session, api_base, api_key, media):
+    if media.size <= INLINE_MAX_BYTES:
+        media.file.seek(0)
+        data = base64.b64encode(media.file.read()).decode()
+        return {'inline_data': {'mime_type': media.mime_type, 'data': data}}
+
+    file_uri = await upload_file(session, api_base, api_key, media)
+    return {'file_data': {'mime_type': media.mime_type, 'file_uri': file_uri}}
+
+async def upload_file(session, api_base, api_key, media):
+    upload_base = api_base.replace('/v1beta', '/upload/v1beta')
+    headers = {
+        'X-Goog-Upload-Protocol': 'resumable',
+        'X-Goog-Upload-Command': 'start',
+        'X-Goog-Upload-Header-Content-Length': str(media.size),
+        'X-Goog-Upload-Header-Content-Type': media.mime_type
+    }
+    async with session.post(f'{upload_base}/files?key={api_key}', json={'file': {}}, headers=headers) as response:
+        if response.status != 200:
+            raise MediaError(f'Upload start failed with status {response.status}')
+        upload_url = response.headers['X-Goog-Upload-URL']
+
+    headers = {
+        'Content-Length': str(media.size),
+        'X-Goog-Upload-Offset': '0',
+        'X-Goog-Upload-Command': 'upload, finalize'
+    }
+    async with session.post(upload_url, data=iterate_chunks(media), headers=headers) as response:
+        if response.status != 200:
+            raise MediaError(f'Upload failed with status {response.status}')
+        uploaded = (await response.json())['file']
+
+    # Audio and video need a moment of server-side processing before they can be referenced
+    for _ in range(FILE_POLL_ATTEMPTS):
+        if uploaded.get('state') != 'PROCESSING':
+            break
+        await asyncio.sleep(1)
+        async with session.get(f"{api_base}/{uploaded['name']}?key={api_key}") as response:
+            uploaded = await response.json()
+
+    if uploaded.get('state') == 'FAILED':
+        raise MediaError('Gemini could not process the uploaded file')
+    return uploaded['uri']
+
+async def iterate_chunks(media):
+    for chunk in media.read_chunks():
+        yield chunk
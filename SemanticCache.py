@@ -0,0 +1,158 @@
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+
+import aiohttp
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+CACHE_DIR = 'semantic_cache'
+EMBEDDING_MODEL = 'text-embedding-004'
+DIMENSIONS = 768
+THRESHOLD = 0.92  # Cosine similarity above which a cached answer is reused
+MAX_ENTRIES = 5000
+SAVE_EVERY = 20  # Answers are written to disk after this many new entries
+
+async def gemini_embedding(text, api_key, api_base):
+    url = f'{api_base}/models/{EMBEDDING_MODEL}:embedContent?key={api_key}'
+    payload = {'model': f'models/{EMBEDDING_MODEL}', 'content': {'parts': [{'text': text}]}}
+    import Bot
+
+    try:
+        # The pooled Gemini session, so the lookup does not pay for a fresh TCP and TLS handshake
+        async with Bot.get_gemini_session().post(url, json=payload) as response:
+            if response.status != 200:
+                return None
+            return (await response.json())['embedding']['values']
+    except (aiohttp.ClientError, asyncio.TimeoutError, KeyError):
+        return None
+
+async def hashed_embedding(text, api_key=None, api_base=None):
+    # Offline stand-in for the embedding endpoint: hashed bag of words and word pairs
+    vector = np.zeros(DIMENSIONS, dtype=np.float32)
+    words = re.findall(r'\w+', text.lower())
+    for token in words + [a + ' ' + b for a, b in zip(words, words[1:])]:
+        digest = hashlib.md5(token.encode()).digest()
+        vector[int.from_bytes(digest[:4], 'little') % DIMENSIONS] += 1 if digest[4] & 1 else -1
+    return vector
+
+EMBED = gemini_embedding  # Set to hashed_embedding to run without the embedding endpoint
+
+class SemanticCache:
+    def __init__(self, path, namespace='', embed=None, threshold=None, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.embed_function = embed or EMBED
+        self.threshold = THRESHOLD if threshold is None else threshold
+        self.max_entries = max_entries
+        self.unsaved = 0
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, exist_ok=True)
+
+        meta_file = os.path.join(path, 'answers.json')
+        meta = {}
+        if os.path.exists(meta_file):
+            with open(meta_file, 'r', encoding='utf-8') as f:
+                try:
+                    meta = json.load(f)
+                except ValueError:
+                    pass
+
+        self.vectors = self.open_array('vectors.npy', np.float32, (max_entries, DIMENSIONS))
+        self.last_used = self.open_array('last_used.npy', np.float64, (max_entries,))
+        self.answers = meta.get('answers', [])
+        self.replay_evictions()
+        self.namespace = meta.get('namespace', namespace)
+        if self.namespace != namespace or len(self.answers) > max_entries:
+            self.clear(namespace)
+
+    def replay_evictions(self):
+        # Answers that replaced evicted ones since the last save, a torn last line is left out
+        journal_file = os.path.join(self.path, 'evictions.jsonl')
+        if not os.path.exists(journal_file):
+            return
+        with open(journal_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    index, answer = json.loads(line)
+                except ValueError:
+                    break
+                if index < len(self.answers):
+                    self.answers[index] = answer
+
+    def open_array(self, name, dtype, shape):
+        # Memory-mapped so a large index opens instantly and pages in on demand
+        file_name = os.path.join(self.path, name)
+        if os.path.exists(file_name):
+            array = np.load(file_name, mmap_mode='r+')
+            if array.shape == shape and array.dtype == dtype:
+                return array
+            del array
+        return np.lib.format.open_memmap(file_name, mode='w+', dtype=dtype, shape=shape)
+
+    async def embed(self, text, api_key, api_base):
+        values = await self.embed_function(text, api_key, api_base)
+        if values is None:
+            return None
+        vector = np.asarray(values, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if vector.shape != (DIMENSIONS,) or not norm:
+            return None
+        return vector / norm
+
+    def lookup(self, vector):
+        count = len(self.answers)
+        if count:
+            scores = self.vectors[:count] @ vector
+            index = int(np.argmax(scores))
+            if scores[index] >= self.threshold:
+                self.hits += 1
+                self.last_used[index] = time.time()
+                return self.answers[index]
+        self.misses += 1
+        return None
+
+    def add(self, vector, answer):
+        if len(self.answers) < self.max_entries:
+            index = len(self.answers)
+            self.answers.append(answer)
+        else:
+            index = int(np.argmin(self.last_used))
+            # The slot is blanked and the new answer journaled before the vector is written,
+            # so after a crash an old vector is never paired with the new answer
+            self.vectors[index] = 0
+            with open(os.path.join(self.path, 'evictions.jsonl'), 'a', encoding='utf-8') as f:
+                f.write(json.dumps([index, answer]) + '\n')
+            self.answers[index] = answer
+
+        self.vectors[index] = vector
+        self.last_used[index] = time.time()
+        self.unsaved += 1
+        if self.unsaved >= SAVE_EVERY:
+            self.save()
+
+    def clear(self, namespace=''):
+        self.namespace = namespace
+        self.answers = []
+        self.last_used[:] = 0
+        self.save()
+
+    def save(self):
+        self.vectors.flush()
+        self.last_used.flush()
+        meta_file = os.path.join(self.path, 'answers.json')
+        with open(meta_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'namespace': self.namespace, 'answers': self.answers}, f)
+        os.replace(meta_file + '.tmp', meta_file)
+        # Everything journaled is in answers.json now
+        open(os.path.join(self.path, 'evictions.jsonl'), 'w').close()
+        self.unsaved = 0
+
+    def close(self):
+        self.save()
@@ -0,0 +1,190 @@
+import asyncio
+import contextlib
+import heapq
+import itertools
+import time
+
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction
+
+GLOBAL_RATE = 30  # Messages per second Telegram accepts from one bot
+CHAT_INTERVAL = 1.0  # Seconds between messages to the same private chat
+GROUP_INTERVAL = 3.0  # Groups are limited to about 20 messages per minute
+MAX_RETRIES = 5
+ACTION_TTL = 5  # Chat actions older than this are pointless, Telegram clears them anyway
+ACTION_REFRESH = 4.5  # Telegram shows a chat action for about 5 seconds
+
+REPLY = 0
+ACTION = 1
+
+class Sender:
+    def __init__(self, bot, rate=GLOBAL_RATE):
+        self.bot = bot
+        self.rate = rate
+        self.tokens = rate
+        self.refilled = time.monotonic()
+        self.paused_until = 0  # Set when Telegram reports the bot-wide limit
+        self.counter = itertools.count()
+        self.chats = {}  # chat_id -> heap of (priority, seq, created, method, future, retries)
+        self.chat_ready = {}  # chat_id -> monotonic time the chat may be sent to again
+        self.actions = {}  # (chat_id, action) -> future of a queued chat action
+        self.keepers = {}  # (chat_id, action) -> [number of requests, refresh task]
+        self.wakeup = asyncio.Event()
+        self.task = None
+        self.delivering = set()
+        self.sent = 0
+        self.retried = 0
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self, timeout=5):
+        deadline = time.monotonic() + timeout
+        while (self.depth() or self.delivering) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.task:
+            self.task.cancel()
+            await asyncio.gather(self.task, return_exceptions=True)
+        for queue in self.chats.values():
+            for item in queue:
+                item[4].cancel()
+        self.chats.clear()
+
+    def depth(self):
+        return sum(len(queue) for queue in self.chats.values())
+
+    def send(self, method, chat_id, priority=REPLY):
+        future = asyncio.get_running_loop().create_future()
+        self.push(chat_id, (priority, next(self.counter), time.monotonic(), method, future, 0))
+        return future
+
+    def send_action(self, chat_id, action='typing'):
+        # Only one pending action per chat, later requests share it
+        key = (chat_id, action)
+        future = self.actions.get(key)
+        if future is None or future.done():
+            future = self.send(SendChatAction(chat_id=chat_id, action=action), chat_id, ACTION)
+            # Nobody waits on chat actions, a failed one must not be reported as unretrieved
+            future.add_done_callback(lambda f: f.cancelled() or f.exception())
+            future.add_done_callback(lambda f: self.actions.pop(key, None))
+            self.actions[key] = future
+        return future
+
+    @contextlib.asynccontextmanager
+    async def keep_action(self, chat_id, action='typing'):
+        # Concurrent requests in one chat share a single refresh task
+        key = (chat_id, action)
+        keeper = self.keepers.get(key)
+        if keeper is None:
+            keeper = self.keepers[key] = [0, asyncio.create_task(self.refresh_action(chat_id, action))]
+        keeper[0] += 1
+        try:
+            yield
+        finally:
+            keeper[0] -= 1
+            if not keeper[0]:
+                keeper[1].cancel()
+                del self.keepers[key]
+                # A queued action sent after the reply would show typing for another 5 seconds
+                if key in self.actions:
+                    self.actions[key].cancel()
+
+    async def refresh_action(self, chat_id, action):
+        while True:
+            self.send_action(chat_id, action)
+            await asyncio.sleep(ACTION_REFRESH)
+
+    def push(self, chat_id, item):
+        heapq.heappush(self.chats.setdefault(chat_id, []), item)
+        self.wakeup.set()
+
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        # The bucket starts filling again once the pause is over
+        self.tokens = 0
+        self.refilled = self.paused_until
+
+    def take_token(self, now):
+        if now < self.paused_until:
+            return self.paused_until - now
+        self.tokens = min(self.rate, self.tokens + (now - self.refilled) * self.rate)
+        self.refilled = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def next_item(self, now):
+        best = None
+        wait = None
+        for chat_id, queue in self.chats.items():
+            ready = self.chat_ready.get(chat_id, 0)
+            if ready > now:
+                wait = ready - now if wait is None else min(wait, ready - now)
+                continue
+            if best is None or queue[0][:2] < self.chats[best][0][:2]:
+                best = chat_id
+        return best, wait
+
+    async def run(self):
+        while True:
+            now = time.monotonic()
+            chat_id, wait = self.next_item(now)
+            if chat_id is None:
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self.take_token(now)
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+
+            queue = self.chats[chat_id]
+            item = heapq.heappop(queue)
+            if not queue:
+                del self.chats[chat_id]
+
+            priority, seq, created, method, future, retries = item
+            if future.done() or (priority == ACTION and now - created > ACTION_TTL):
+                if not future.done():
+                    future.set_result(None)
+                continue
+
+            task = asyncio.create_task(self.deliver(chat_id, item))
+            self.delivering.add(task)
+            task.add_done_callback(self.delivering.discard)
+            if priority == REPLY:
+                interval = GROUP_INTERVAL if isinstance(chat_id, int) and chat_id < 0 else CHAT_INTERVAL
+                self.chat_ready[chat_id] = now + interval
+            self.forget_idle_chats(now)
+
+    async def deliver(self, chat_id, item):
+        priority, seq, created, method, future, retries = item
+        try:
+            result = await self.bot(method)
+        except TelegramRetryAfter as e:
+            if retries >= MAX_RETRIES:
+                if not future.done():
+                    future.set_exception(e)
+                return
+            self.retried += 1
+            self.chat_ready[chat_id] = time.monotonic() + e.retry_after
+            if not (isinstance(chat_id, int) and chat_id < 0):
+                # Private chats are already paced below their own limit, so this is the bot-wide one
+                self.pause(e.retry_after)
+            self.push(chat_id, (priority, seq, created, method, future, retries + 1))
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            self.sent += 1
+            if not future.done():
+                future.set_result(result)
+
+    def forget_idle_chats(self, now):
+        if len(self.chat_ready) > 10000:
+            self.chat_ready = {chat_id: ready for chat_id, ready in self.chat_ready.items() if ready > now}
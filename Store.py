@@ -0,0 +1,105 @@
+import sqlite3
+
+STORE_FILE = "Bot.db"
+WINDOW_SIZE = 4096  # Most recent update ids remembered per bot (a 512 byte bitmap)
+
+def get_bot_id(telegram_token):
+    return telegram_token.split(':', 1)[0]
+
+def connect(path=STORE_FILE):
+    connection = sqlite3.connect(path, timeout=5)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('PRAGMA synchronous=NORMAL')
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS updates (
+            bot_id TEXT PRIMARY KEY,
+            next_offset INTEGER,
+            window_base INTEGER NOT NULL,
+            window BLOB NOT NULL
+        )
+    """)
+    return connection
+
+class UpdateWindow:
+    # Ring buffer of bits covering update ids [base, base + size)
+    def __init__(self, base=0, bits=None, size=WINDOW_SIZE):
+        self.size = size
+        self.base = base
+        self.bits = bytearray(bits) if bits else bytearray(size // 8)
+
+    def __contains__(self, update_id):
+        if update_id < self.base:
+            return True  # Slid out recently, ids far below the window are caught by UpdateStore.check_reset
+        if update_id >= self.base + self.size:
+            return False
+        index = update_id % self.size
+        return bool(self.bits[index // 8] & (1 << index % 8))
+
+    def add(self, update_id):
+        if update_id < self.base:
+            return  # Would alias a newer id in the ring
+        self.slide(update_id - self.size + 1)
+        index = update_id % self.size
+        self.bits[index // 8] |= 1 << index % 8
+
+    def slide(self, base):
+        if base <= self.base:
+            return
+        if base - self.base >= self.size:
+            self.bits = bytearray(self.size // 8)
+        else:
+            for update_id in range(self.base, base):
+                index = update_id % self.size
+                self.bits[index // 8] &= ~(1 << index % 8) & 0xFF
+        self.base = base
+
+class UpdateStore:
+    def __init__(self, bot_id, path=STORE_FILE):
+        self.bot_id = bot_id
+        self.connection = connect(path)
+        row = self.connection.execute(
+            'SELECT next_offset, window_base, window FROM updates WHERE bot_id = ?',
+            (bot_id,)
+        ).fetchone()
+
+        if row:
+            self.offset = row[0]
+            self.window = UpdateWindow(row[1], row[2])
+        else:
+            self.offset = None
+            self.window = UpdateWindow()
+
+    def __contains__(self, update_id):
+        if self.check_reset(update_id):
+            return False
+        return update_id in self.window
+
+    def check_reset(self, update_id):
+        # After a week without updates Telegram restarts ids at a random value, possibly below the window
+        if update_id >= self.window.base - self.window.size:
+            return False
+        self.window = UpdateWindow(size=self.window.size)
+        self.offset = None
+        self.save()
+        return True
+
+    def add(self, update_id):
+        if update_id in self.window:
+            return False
+        self.window.add(update_id)
+        self.save()
+        return True
+
+    def save_offset(self, offset):
+        self.offset = offset
+        self.save()
+
+    def save(self):
+        with self.connection:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO updates (bot_id, next_offset, window_base, window) VALUES (?, ?, ?, ?)',
+                (self.bot_id, self.offset, self.window.base, bytes(self.window.bits))
+            )
+
+    def close(self):
+        self.connection.close()
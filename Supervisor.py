@@ -0,0 +1,297 @@
+import asyncio
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import queue
+import signal
+import sys
+import time
+
+import Diagnostics
+import Store
+
+CONFIG_FILE = "Bot.settings"
+REPLICAS = 100  # Points per shard on the hash ring, more points spread bots more evenly
+STATUS_INTERVAL = 2
+RESTART_BACKOFF = 1
+MAX_RESTART_BACKOFF = 60
+STABLE_AFTER = 30  # A shard running this long has its restart backoff reset
+
+def load_bots(config_file=CONFIG_FILE):
+    if not os.path.exists(config_file):
+        return []
+    with open(config_file, 'r') as f:
+        try:
+            settings = json.load(f)
+        except ValueError:
+            return []
+    return [bot for bot in settings if bot and bot.get("telegram_token") and bot.get("gemini_token")]
+
+def ring_hash(key):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], 'big')
+
+class HashRing:
+    def __init__(self, nodes, replicas=REPLICAS):
+        self.points = sorted((ring_hash(f'{node}#{i}'), node) for node in nodes for i in range(replicas))
+        self.keys = [point[0] for point in self.points]
+
+    def get(self, key):
+        index = bisect.bisect(self.keys, ring_hash(key)) % len(self.points)
+        return self.points[index][1]
+
+def run_shard(name, bots, commands, statuses):
+    # Ctrl+C is handled by the supervisor, which stops shards gracefully
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if hasattr(signal, 'SIGUSR1'):
+        # Diagnostics requests arrive as commands forwarded by the supervisor
+        signal.signal(signal.SIGUSR1, signal.SIG_IGN)
+        signal.signal(signal.SIGUSR2, signal.SIG_IGN)
+    asyncio.run(shard_loop(name, bots, commands, statuses))
+
+async def shard_loop(name, bots, commands, statuses):
+    import Bot
+
+    # Shards are daemonic and can't start queue workers, they already spread the bots over cores
+    Bot.QUEUE_WORKERS = 0
+    loop = asyncio.get_running_loop()
+    runtimes = {}
+    tasks = {}
+    errors = {}
+    validating = asyncio.Semaphore(Bot.VALIDATE_CONCURRENCY)
+
+    async def keep_running(runtime, previous=None):
+        if previous:
+            # The old runtime of a re-added bot drains first, two pollers on one token would conflict
+            await asyncio.wait([previous])
+        async with validating:
+            await runtime.prepare()
+        delay = RESTART_BACKOFF
+        while not runtime.stop_requested:
+            try:
+                # A stale failure from an earlier attempt must not show once the bot is back up
+                errors.pop(runtime.bot_id, None)
+                await runtime.run()
+            except Exception as e:
+                errors[runtime.bot_id] = str(e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RESTART_BACKOFF)
+
+    def assign(bots):
+        wanted = {Store.get_bot_id(bot["telegram_token"]): bot for bot in bots}
+        for bot_id in list(runtimes):
+            if bot_id not in wanted:
+                runtimes.pop(bot_id).stop()
+        for bot_id, bot in wanted.items():
+            runtime = runtimes.get(bot_id)
+            if runtime and (runtime.telegram_token, runtime.gemini_key) != (bot["telegram_token"], bot["gemini_token"]):
+                runtimes.pop(bot_id).stop()
+            elif runtime:
+                runtime.apply_settings(bot.get("messages"), bot.get("system_instruction", ""))
+            if bot_id not in runtimes:
+                runtime = Bot.BotRuntime(
+                    bot["telegram_token"], bot["gemini_token"],
+                    bot.get("messages"), bot.get("system_instruction", "")
+                )
+                runtimes[bot_id] = runtime
+                errors.pop(bot_id, None)
+                tasks[bot_id] = asyncio.create_task(keep_running(runtime, tasks.get(bot_id)))
+
+    def report():
+        bots = {}
+        for bot_id, runtime in runtimes.items():
+            sender = runtime.sender
+            bots[bot_id] = {
+                'running': runtime.dispatcher is not None and not tasks[bot_id].done(),
+                'in_flight': len(runtime.in_flight),
+                'send_queue': sender.depth() if sender else 0,
+                'sent': sender.sent if sender else 0,
+                'retried': sender.retried if sender else 0,
+                'username': runtime.username,
+                'error': runtime.error or errors.get(bot_id),
+                'warning': runtime.warning
+            }
+        statuses.put({'shard': name, 'pid': os.getpid(), 'time': time.time(), 'bots': bots})
+
+    async def reporter():
+        while True:
+            report()
+            await asyncio.sleep(STATUS_INTERVAL)
+
+    assign(bots)
+    reporting = asyncio.create_task(reporter())
+    while True:
+        command = await loop.run_in_executor(None, commands.get)
+        if command[0] == 'assign':
+            assign(command[1])
+        elif command[0] == 'diagnostics':
+            if command[1] == 'snapshot':
+                Diagnostics.snapshot(prefix=name)
+            elif command[1] == 'start':
+                Diagnostics.start()
+            elif command[1] == 'stop':
+                Diagnostics.stop()
+            else:
+                Diagnostics.toggle()
+        elif command[0] == 'stop':
+            break
+
+    reporting.cancel()
+    for runtime in runtimes.values():
+        runtime.stop()
+    await asyncio.gather(*tasks.values(), return_exceptions=True)
+    await Bot.close_gemini_session()
+
+class Shard:
+    def __init__(self, name):
+        self.name = name
+        self.process = None
+        self.commands = None
+        self.bots = []
+        self.started = 0
+        self.failures = 0
+        self.restart_at = 0
+
+class Supervisor:
+    def __init__(self, workers=None, config_file=CONFIG_FILE):
+        self.workers = workers or os.cpu_count() or 1
+        self.config_file = config_file
+        self.statuses = multiprocessing.Queue()
+        self.shards = {}
+        self.health = {}  # shard name -> last status report
+        self.bots = []
+
+    def start(self, bots=None):
+        self.bots = load_bots(self.config_file) if bots is None else bots
+        self.resize(self.workers)
+
+    def resize(self, workers):
+        self.workers = workers
+        names = [f'shard-{index}' for index in range(workers)]
+        removed = [self.shards.pop(name) for name in list(self.shards) if name not in names]
+        self.stop_shards(removed)
+        for shard in removed:
+            self.health.pop(shard.name, None)
+        for name in names:
+            self.shards.setdefault(name, Shard(name))
+        self.assign()
+
+    def assign(self):
+        # Consistent hashing keeps most bots on their shard when the shard count changes
+        ring = HashRing(self.shards)
+        assignment = {name: [] for name in self.shards}
+        for bot in self.bots:
+            assignment[ring.get(Store.get_bot_id(bot["telegram_token"]))].append(bot)
+
+        for name, bots in assignment.items():
+            shard = self.shards[name]
+            shard.bots = bots
+            if shard.process and shard.process.is_alive():
+                shard.commands.put(('assign', bots))
+            elif bots:
+                self.start_shard(shard)
+
+    def set_bots(self, bots):
+        self.bots = bots
+        self.assign()
+
+    def diagnostics(self, action):
+        # 'snapshot', 'start', 'stop' or 'toggle', every shard writes its own bundle
+        for shard in self.shards.values():
+            if shard.process and shard.process.is_alive():
+                shard.commands.put(('diagnostics', action))
+
+    def start_shard(self, shard):
+        shard.commands = multiprocessing.Queue()
+        shard.process = multiprocessing.Process(
+            target=run_shard,
+            args=(shard.name, shard.bots, shard.commands, self.statuses),
+            name=shard.name,
+            daemon=True
+        )
+        shard.process.start()
+        shard.started = time.monotonic()
+
+    def stop_shards(self, shards, timeout=15):
+        # Every shard drains at the same time, so stopping many shards takes one timeout
+        running = [shard for shard in shards if shard.process and shard.process.is_alive()]
+        for shard in running:
+            shard.commands.put(('stop',))
+        deadline = time.monotonic() + timeout
+        for shard in running:
+            shard.process.join(max(0, deadline - time.monotonic()))
+            if shard.process.is_alive():
+                shard.process.terminate()
+        for shard in shards:
+            shard.process = None
+
+    def poll(self):
+        while True:
+            try:
+                status = self.statuses.get_nowait()
+            except queue.Empty:
+                break
+            self.health[status['shard']] = status
+
+        now = time.monotonic()
+        for shard in self.shards.values():
+            if not shard.bots or (shard.process and shard.process.is_alive()):
+                continue
+            if shard.process:
+                # Crashed, restart after an exponential backoff
+                if now - shard.started > STABLE_AFTER:
+                    shard.failures = 0
+                shard.failures += 1
+                shard.restart_at = now + min(RESTART_BACKOFF * 2 ** (shard.failures - 1), MAX_RESTART_BACKOFF)
+                shard.process = None
+                self.health.pop(shard.name, None)
+            if now >= shard.restart_at:
+                self.start_shard(shard)
+        return self.status()
+
+    def status(self):
+        bots = {}
+        for shard in self.health.values():
+            for bot_id, bot in shard['bots'].items():
+                bots[bot_id] = dict(bot, shard=shard['shard'], pid=shard['pid'])
+        return {
+            'shards': {
+                name: {
+                    'alive': bool(shard.process and shard.process.is_alive()),
+                    'bots': len(shard.bots),
+                    'failures': shard.failures
+                } for name, shard in self.shards.items()
+            },
+            'bots': bots
+        }
+
+    def stop(self):
+        self.stop_shards(list(self.shards.values()))
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    Diagnostics.install_signal_handlers(
+        lambda: supervisor.diagnostics('snapshot'),
+        lambda: supervisor.diagnostics('toggle')
+    )
+    print(f"Running {len(supervisor.bots)} bots on {supervisor.workers} processes, press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(STATUS_INTERVAL)
+            for bot_id, bot in sorted(supervisor.poll()['bots'].items()):
+                state = "error: " + bot['error'] if bot['error'] else ("running" if bot['running'] else "starting")
+                if bot['warning'] and not bot['error']:
+                    state += ", degraded: " + bot['warning']
+                name = '@' + bot['username'] if bot['username'] else bot_id
+                print(f"{name:>24} {bot['shard']:>9} in flight {bot['in_flight']:>3} sent {bot['sent']:>6} {state}")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        supervisor.stop()
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    main()
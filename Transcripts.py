@@ -0,0 +1,114 @@
+import glob
+import gzip
+import json
+import os
+import re
+import time
+from collections import deque
+
+import Writer
+
+TRANSCRIPT_DIR = 'transcripts'
+FLUSH_INTERVAL = 2
+MAX_PENDING = 10000  # Records waiting for the writer, newer ones are dropped and counted when it falls behind
+MAX_FILE_BYTES = 16 * 1024 * 1024  # Compressed size after which a new file is started
+MAX_FILES = 200  # Oldest files are deleted beyond this many
+
+TOKEN_PATTERNS = [
+    re.compile(r'\b\d{6,12}:[A-Za-z0-9_-]{30,}'),  # Telegram bot tokens
+    re.compile(r'\bAIza[0-9A-Za-z_-]{35}\b'),  # Google API keys
+    re.compile(r'([?&]key=)[^&\s]+')
+]
+
+pending = deque()
+dropped = 0
+reported_drops = 0
+written = 0
+current_file = None
+
+def record(bot_id, chat_id, user_id, message_id, prompt, response, source, latency):
+    # Only a tuple is queued here, formatting, redaction and disk writes happen on the writer thread
+    global dropped
+
+    if len(pending) >= MAX_PENDING:
+        dropped += 1
+        return
+    pending.append((time.time(), bot_id, chat_id, user_id, message_id, prompt, response, source, latency))
+    writer.start()
+
+def redact(text):
+    if not text:
+        return text
+    for pattern in TOKEN_PATTERNS:
+        text = pattern.sub(lambda match: (match.group(1) if pattern.groups else '') + '[REDACTED]', text)
+    return text
+
+def get_mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0  # Pruned by another process in the meantime
+
+def get_file(size_needed=0):
+    global current_file
+
+    day = time.strftime('%Y%m%d')
+    if current_file and os.path.basename(current_file).startswith(f'transcript-{day}-') and (
+        not os.path.exists(current_file) or os.path.getsize(current_file) + size_needed <= MAX_FILE_BYTES
+    ):
+        return current_file
+
+    # Every process writes its own files, so bots in worker processes never share one
+    os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+    current_file = os.path.join(TRANSCRIPT_DIR, f'transcript-{day}-{time.strftime("%H%M%S")}-{os.getpid()}.jsonl.gz')
+    files = sorted(glob.glob(os.path.join(TRANSCRIPT_DIR, 'transcript-*.jsonl.gz')), key=get_mtime)
+    for old_file in files[:max(0, len(files) - MAX_FILES + 1)]:
+        try:
+            os.remove(old_file)
+        except OSError:
+            pass
+    return current_file
+
+def write_batch():
+    global dropped, reported_drops, written
+
+    lines = []
+    while pending:
+        created, bot_id, chat_id, user_id, message_id, prompt, response, source, latency = pending.popleft()
+        lines.append(json.dumps({
+            'time': round(created, 3),
+            'bot_id': bot_id,
+            'chat_id': chat_id,
+            'user_id': user_id,
+            'message_id': message_id,
+            'source': source,
+            'latency_ms': int(latency * 1000),
+            'prompt': redact(prompt),
+            'response': redact(response)
+        }, ensure_ascii=False))
+    count = len(lines)
+    previous_drops = reported_drops
+    if dropped > reported_drops:
+        # Marks the gap so reviewers know records are missing
+        lines.append(json.dumps({'time': round(time.time(), 3), 'dropped': dropped - reported_drops}))
+        reported_drops = dropped
+    if not lines:
+        return
+
+    data = gzip.compress(('\n'.join(lines) + '\n').encode('utf-8'))
+    try:
+        # Each batch is its own gzip member, gzip readers treat the file as one stream
+        with open(get_file(len(data)), 'ab') as f:
+            f.write(data)
+    except OSError:
+        # The lost batch and any earlier gap are reported once the disk accepts writes again
+        dropped += count
+        reported_drops = previous_drops
+        raise
+    written += count
+
+writer = Writer.BatchWriter('transcript-writer', write_batch, FLUSH_INTERVAL)
+flush = writer.flush
+
+def stats():
+    return {'pending': len(pending), 'dropped': dropped, 'written': written}
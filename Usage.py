@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import time
+from collections import deque
+
+import Store
+import Writer
+
+DAILY_TOKEN_BUDGET = 0  # Tokens a user may spend per bot and day, 0 disables the limit
+FLUSH_INTERVAL = 2
+BUDGET_REFRESH = 60  # Seconds before a user's daily total is re-read from the store
+MAX_PENDING = 100000  # Rows waiting for the writer, the oldest are dropped while the store stays unavailable
+MAX_TOTALS = 10000  # Cached daily totals, stale ones are pruned beyond this many
+
+pending = deque(maxlen=MAX_PENDING)
+daily_totals = {}  # (day, bot_id, user_id) -> [tokens, loaded_at]
+
+def connect(path=Store.STORE_FILE):
+    connection = Store.connect(path)
+    connection.execute("""
+        CREATE TABLE IF NOT EXISTS usage_hourly (
+            hour INTEGER NOT NULL,
+            bot_id TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            model TEXT NOT NULL,
+            key_id TEXT NOT NULL,
+            requests INTEGER NOT NULL,
+            prompt_tokens INTEGER NOT NULL,
+            output_tokens INTEGER NOT NULL,
+            latency_ms INTEGER NOT NULL,
+            PRIMARY KEY (hour, bot_id, user_id, model, key_id)
+        )
+    """)
+    return connection
+
+def get_key_id(api_key):
+    # Only a fingerprint of the key is stored
+    return hashlib.sha256(api_key.encode()).hexdigest()[:8]
+
+def record(bot_id, user_id, model, api_key, metadata, latency):
+    prompt_tokens = metadata.get('promptTokenCount', 0)
+    output_tokens = metadata.get('candidatesTokenCount', 0)
+    now = time.time()
+    pending.append((
+        int(now // 3600), bot_id, user_id or 0, model, get_key_id(api_key),
+        1, prompt_tokens, output_tokens, int(latency * 1000)
+    ))
+
+    total = daily_totals.get((int(now // 86400), bot_id, user_id))
+    if total:
+        total[0] += prompt_tokens + output_tokens
+    writer.start()
+
+def write_batch():
+    rows = {}
+    while pending:
+        hour, bot_id, user_id, model, key_id, requests, prompt_tokens, output_tokens, latency = pending.popleft()
+        row = rows.setdefault((hour, bot_id, user_id, model, key_id), [0, 0, 0, 0])
+        row[0] += requests
+        row[1] += prompt_tokens
+        row[2] += output_tokens
+        row[3] += latency
+    if not rows:
+        return
+
+    rows = [key + tuple(values) for key, values in rows.items()]
+    try:
+        connection = connect()
+        try:
+            with connection:
+                connection.executemany("""
+                    INSERT INTO usage_hourly VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT (hour, bot_id, user_id, model, key_id) DO UPDATE SET
+                        requests = requests + excluded.requests,
+                        prompt_tokens = prompt_tokens + excluded.prompt_tokens,
+                        output_tokens = output_tokens + excluded.output_tokens,
+                        latency_ms = latency_ms + excluded.latency_ms
+                """, rows)
+        finally:
+            connection.close()
+    except Exception:
+        # Usually another process holding the database, the rows are written on the next pass
+        pending.extendleft(rows)
+        raise
+
+writer = Writer.BatchWriter('usage-writer', write_batch, FLUSH_INTERVAL)
+flush = writer.flush
+
+async def is_over_budget(bot_id, user_id, budget=None):
+    budget = DAILY_TOKEN_BUDGET if budget is None else budget
+    if not budget:
+        return False
+
+    now = time.time()
+    day = int(now // 86400)
+    total = daily_totals.get((day, bot_id, user_id))
+    if total is None or now - total[1] > BUDGET_REFRESH:
+        # Read on a thread, the database may be busy with writers from other processes
+        tokens = await asyncio.get_running_loop().run_in_executor(None, query_one, """
+            SELECT COALESCE(SUM(prompt_tokens + output_tokens), 0) FROM usage_hourly
+            WHERE bot_id = ? AND user_id = ? AND hour >= ?
+        """, (bot_id, user_id, day * 24))
+        if len(daily_totals) >= MAX_TOTALS:
+            prune_totals(now)
+        total = daily_totals[(day, bot_id, user_id)] = [tokens, now]
+    return total[0] >= budget
+
+def prune_totals(now):
+    # Stale totals are re-read anyway, so dropping them only costs a query
+    for key, total in list(daily_totals.items()):
+        if now - total[1] > BUDGET_REFRESH:
+            daily_totals.pop(key, None)
+
+def query_one(sql, params=()):
+    connection = connect()
+    try:
+        return connection.execute(sql, params).fetchone()[0]
+    finally:
+        connection.close()
+
+def query(sql, params=()):
+    connection = connect()
+    try:
+        cursor = connection.execute(sql, params)
+        columns = [column[0] for column in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        connection.close()
+
+def usage_by_bot(since=0):
+    return query("""
+        SELECT bot_id, SUM(requests) AS requests, SUM(prompt_tokens) AS prompt_tokens,
+               SUM(output_tokens) AS output_tokens, SUM(latency_ms) / SUM(requests) AS avg_latency_ms
+        FROM usage_hourly WHERE hour >= ? GROUP BY bot_id ORDER BY bot_id
+    """, (int(since // 3600),))
+
+def usage_by_user(bot_id, since=0):
+    return query("""
+        SELECT user_id, SUM(requests) AS requests, SUM(prompt_tokens) AS prompt_tokens,
+               SUM(output_tokens) AS output_tokens
+        FROM usage_hourly WHERE bot_id = ? AND hour >= ?
+        GROUP BY user_id ORDER BY SUM(prompt_tokens + output_tokens) DESC
+    """, (bot_id, int(since // 3600)))
+
+def usage_by_hour(bot_id=None, since=0):
+    return query("""
+        SELECT hour * 3600 AS time, SUM(requests) AS requests, SUM(prompt_tokens) AS prompt_tokens,
+               SUM(output_tokens) AS output_tokens, SUM(latency_ms) / SUM(requests) AS avg_latency_ms
+        FROM usage_hourly WHERE (? IS NULL OR bot_id = ?) AND hour >= ?
+        GROUP BY hour ORDER BY hour
+    """, (bot_id, bot_id, int(since // 3600)))
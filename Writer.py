@@ -0,0 +1,39 @@
+import atexit
+import threading
+
+class BatchWriter:
+    # Background thread calling write every interval, started by the first record
+    def __init__(self, name, write, interval):
+        self.name = name
+        self.write = write
+        self.interval = interval
+        self.thread = None
+        self.start_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.wakeup = threading.Event()
+
+    def start(self):
+        if self.thread:
+            return
+        with self.start_lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name=self.name, daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+
+    def wake(self):
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            self.flush()
+
+    def flush(self):
+        # Errors are reported and the thread keeps going, a locked database or a full disk is often temporary
+        with self.write_lock:
+            try:
+                self.write()
+            except Exception as e:
+                print(f"{self.name} failed: {e}")
@@ -0,0 +1,96 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Store
+
+def test_window_remembers_added_ids():
+    window = Store.UpdateWindow(size=16)
+    window.add(3)
+    window.add(5)
+    assert 3 in window
+    assert 5 in window
+    assert 4 not in window
+    assert 20 not in window
+
+def test_window_slides_and_forgets_old_bits():
+    window = Store.UpdateWindow(size=16)
+    window.add(1)
+    window.add(17)  # Slides the base to 2, id 1 falls out of the window
+    assert window.base == 2
+    assert 17 in window
+    assert 1 in window  # Below the window counts as seen
+    # Slot of id 1 is reused by 17, its neighbours must not be set
+    assert 18 not in window
+    assert 33 not in window
+
+def test_window_clears_bits_it_slides_over():
+    window = Store.UpdateWindow(size=16)
+    window.add(10)
+    window.slide(8)
+    assert 10 in window
+    window.add(30)  # Base 15, id 10 is gone and its slot (26) starts empty
+    assert 26 not in window
+    assert 30 in window
+
+def test_window_resets_on_large_jump():
+    window = Store.UpdateWindow(size=16)
+    for update_id in range(16):
+        window.add(update_id)
+    window.add(1000)
+    assert window.base == 985
+    assert all(update_id not in window for update_id in range(985, 1000))
+    assert 1000 in window
+
+def test_window_ignores_ids_below_base():
+    window = Store.UpdateWindow(size=16)
+    window.add(40)
+    window.add(20)  # Below base 25, setting its slot would mark id 36
+    assert 36 not in window
+
+def test_store_persists_window_and_offset(tmp_path):
+    path = str(tmp_path / 'Bot.db')
+    store = Store.UpdateStore('123', path)
+    assert store.offset is None
+    assert store.add(100)
+    assert not store.add(100)
+    store.save_offset(101)
+    store.close()
+
+    store = Store.UpdateStore('123', path)
+    assert store.offset == 101
+    assert 100 in store
+    assert 99 not in store
+    store.close()
+
+    other = Store.UpdateStore('456', path)
+    assert 100 not in other
+    other.close()
+
+def test_store_resets_when_ids_restart_lower(tmp_path):
+    path = str(tmp_path / 'Bot.db')
+    store = Store.UpdateStore('123', path)
+    store.add(500000)
+    store.save_offset(500001)
+
+    # Telegram picked a random lower id after a week without updates
+    assert 1234 not in store
+    assert store.offset is None
+    assert store.add(1234)
+    assert 1234 in store
+    assert 1235 not in store
+    store.close()
+
+    store = Store.UpdateStore('123', path)
+    assert store.offset is None
+    assert 1234 in store
+    assert 500000 not in store
+    store.close()
+
+def test_store_keeps_recent_ids_below_window_as_seen(tmp_path):
+    store = Store.UpdateStore('123', str(tmp_path / 'Bot.db'))
+    store.add(100000)
+    assert store.window.base - 1 in store
+    assert not store.check_reset(store.window.base - 1)
+    store.close()